@@ -117,6 +117,8 @@ successPage = """<!DOCTYPE html>
 """
 
 ra = regapi.RegAPI(capabilities, cache = regapi.FileCache("regapi"))
+#Load the avatar list and error codes now, and keep them fresh hourly
+ra.warmUp(refresh = 60*60)
 
 class HandleRequests(BaseHTTPRequestHandler):
     def __init__(self, socket, *args, **kwargs):
@@ -23,6 +23,9 @@ freely, subject to the following restrictions:
 """
 from .regapi import RegAPIError, RegAPI
 from .filecache import FileCache
+from .httppool import ConnectionPool, AsyncConnectionPool
+from .asyncregapi import AsyncRegAPI
+from .namecache import NameCache
 from . import llsd
 
 __author__ = "Kyler Eastridge"
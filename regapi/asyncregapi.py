@@ -0,0 +1,337 @@
+#!/usr/bin/env python3
+"""
+Name: asyncregapi.py
+Purpose: asyncio version of the RegAPI client
+
+Copyright (c) 2021 Kyler Eastridge
+
+This software is provided 'as-is', without any express or implied
+warranty. In no event will the authors be held liable for any damages
+arising from the use of this software.
+
+Permission is granted to anyone to use this software for any purpose,
+including commercial applications, and to alter it and redistribute it
+freely, subject to the following restrictions:
+
+1. The origin of this software must not be misrepresented; you must not
+   claim that you wrote the original software. If you use this software
+   in a product, an acknowledgment in the product documentation would be
+   appreciated but is not required.
+2. Altered source versions must be plainly marked as such, and must not be
+   misrepresented as being the original software.
+3. This notice may not be removed or altered from any source distribution.
+"""
+from . import llsd
+from . import httppool
+from .catalog import Catalogs
+from .singleflight import AsyncSingleFlight
+from .regapi import RegAPI, RegAPIError, parseUsername, createUserData, resolveError, \
+    generateNameVariants, cachedName, copyError
+import asyncio
+import collections
+import warnings
+import urllib.parse
+
+class AsyncRegAPI:
+    """Coroutine version of RegAPI, every method that talks to the server
+        must be awaited. Requests go over a httppool.AsyncConnectionPool so
+        thousands of them can be in flight on one event loop.
+    """
+    LASTNAME_RESIDENT = RegAPI.LASTNAME_RESIDENT
+    MATURITY_GENERAL = RegAPI.MATURITY_GENERAL
+    MATURITY_MODERATE = RegAPI.MATURITY_MODERATE
+    MATURITY_ADULT = RegAPI.MATURITY_ADULT
+    
+    baseHeaders = RegAPI.baseHeaders
+    
+    def __init__(self, capabilities = None, cache = None, pool = None,
+                    nameCache = None, catalogTTL = 60*60,
+                    catalogMaxAge = 24*60*60, catalogJitter = 0.1):
+        """Capabilities, cache, nameCache and the catalog arguments are the
+            same as for RegAPI, stale catalogs are revalidated in a task.
+            Pool is a httppool.AsyncConnectionPool, a new one is made if it is
+            not given.
+        """
+        if capabilities == None:
+            capabilities = []
+        if pool == None:
+            pool = httppool.AsyncConnectionPool()
+        self.capabilities = capabilities
+        self.cache = cache
+        self.pool = pool
+        self.nameCache = nameCache
+        self.catalogs = Catalogs()
+        self.catalogTTL = catalogTTL
+        self.catalogMaxAge = catalogMaxAge
+        self.catalogJitter = catalogJitter
+        self.refresher = None
+        #Capability: revalidation task
+        self.revalidating = {}
+        self.flights = AsyncSingleFlight()
+    
+    async def close(self):
+        """Stop the catalog refresh and close the idle connections of the
+            pool."""
+        self.stopRefresh()
+        for task in list(self.revalidating.values()):
+            task.cancel()
+        await self.pool.close()
+    
+    async def __aenter__(self):
+        return self
+    
+    async def __aexit__(self, *args):
+        await self.close()
+    
+    getCapability = RegAPI.getCapability
+    
+    async def fetch(self, url, data = None, contentType = "application/llsd+xml"):
+        """Internal function, GET url, or POST data to it, and return the
+            decoded response."""
+        headers = dict(self.baseHeaders)
+        method = "GET"
+        if data != None:
+            headers["content-type"] = contentType
+            method = "POST"
+        res = await self.pool.request(method, url, headers, data)
+        return llsd.llsdDecode(res.body)
+    
+    async def post(self, cap, data):
+        """Internal function, POST data to a capability and raise the
+            RegAPIError if the server answers with an error code."""
+        result = await self.fetch(self.getCapability(cap), data)
+        if type(result) == list:
+            raise await self.getError(result[0])
+        return result
+    
+    async def getCatalog(self, cap, refresh = False):
+        """See RegAPI.getCatalog"""
+        url = self.getCapability(cap)
+        entry = self.catalogs.entries.get(cap)
+        if entry == None and self.cache:
+            entry = self.cache.get(Catalogs.cacheKey(cap))
+            if entry:
+                self.catalogs.update(cap, entry)
+        if entry and not refresh:
+            freshness = Catalogs.freshness(entry, self.catalogTTL,
+                self.catalogMaxAge, self.catalogJitter)
+            if freshness == Catalogs.STALE:
+                self.revalidateLater(cap)
+            if freshness != Catalogs.EXPIRED:
+                return self.catalogs.get(cap)
+        
+        return await self.flights.do(("catalog", cap), self.fetchCatalog,
+            cap, url, entry)
+    
+    async def fetchCatalog(self, cap, url, entry):
+        """See RegAPI.fetchCatalog"""
+        res = await self.pool.request("GET", url,
+            {**self.baseHeaders, **Catalogs.validators(entry)})
+        if entry and res.status == 304:
+            entry = Catalogs.revalidated(entry, res.headers)
+        else:
+            result = llsd.llsdDecode(res.body)
+            if Catalogs.converters[cap] and type(result) == list:
+                raise await self.getError(result[0])
+            entry = Catalogs.makeEntry(result, res.headers)
+        
+        if self.cache:
+            #Kept past the cache expiry, its age is judged by catalogMaxAge
+            #and its validators still save a download once it is stale
+            self.cache.set(Catalogs.cacheKey(cap), entry, ttl = 0)
+        
+        return self.catalogs.update(cap, entry)
+    
+    def revalidateLater(self, cap):
+        """See RegAPI.revalidateLater"""
+        if cap not in self.revalidating:
+            self.revalidating[cap] = asyncio.ensure_future(self.revalidate(cap))
+    
+    async def revalidate(self, cap):
+        try:
+            await self.getCatalog(cap, refresh = True)
+        except (Exception, RegAPIError):
+            #Keep serving the stale catalog until it expires
+            pass
+        finally:
+            self.revalidating.pop(cap, None)
+    
+    async def warmUp(self, refresh = None):
+        """See RegAPI.warmUp, the refresh runs as a task on the running loop
+            until stopRefresh() or close() is called."""
+        caps = [cap for cap in Catalogs.converters if cap in self.capabilities]
+        await asyncio.gather(*[self.getCatalog(cap) for cap in caps])
+        
+        if refresh and not self.refresher:
+            async def refreshLoop():
+                while True:
+                    await asyncio.sleep(refresh)
+                    for cap in caps:
+                        try:
+                            await self.getCatalog(cap, refresh = True)
+                        except (Exception, RegAPIError):
+                            #Keep serving the catalog we have
+                            pass
+            
+            self.refresher = asyncio.ensure_future(refreshLoop())
+    
+    def stopRefresh(self):
+        """Stop the background refresh started by warmUp."""
+        if self.refresher:
+            self.refresher.cancel()
+            self.refresher = None
+    
+    async def getCapabilities(self, username, password, IKnowWhatIAmDoing = False):
+        """See RegAPI.getCapabilities"""
+        if not IKnowWhatIAmDoing:
+            warnings.warn("Storing account information in a script is dangerous!")
+        username = parseUsername(username)
+        result = await self.fetch(
+            "https://cap.secondlife.com/get_reg_capabilities",
+            urllib.parse.urlencode({
+                "first_name": username[0],
+                "last_name": username[1],
+                "password": password
+            }).encode(),
+            contentType = "application/x-www-form-urlencoded"
+        )
+        if type(result) == list:
+            raise await self.getError(result[0])
+        
+        self.capabilities = result
+        
+        return result
+    
+    async def getErrorCodes(self):
+        """Returns a list of error codes in [[code, name, desc],...] format."""
+        return await self.getCatalog("get_error_codes")
+    
+    async def getError(self, errCode):
+        """Helper function. Resolve a error code by ID."""
+        if self.catalogs.get("get_error_codes") == None:
+            await self.getErrorCodes()
+        return resolveError(self.catalogs, errCode)
+    
+    async def getLastNames(self):
+        """Returns a list of available usernames in {id: "name", ...} format"""
+        return await self.getCatalog("get_last_names")
+    
+    async def getExperiences(self):
+        """Returns a list of experiences the capability has access to in
+            {id: "name"} format
+        """
+        return await self.getCatalog("get_experiences")
+    
+    async def getAvatars(self):
+        """Returns a list of available starting avatars in {id: "name"} format
+        """
+        return await self.getCatalog("get_avatars")
+    
+    async def checkName(self, username, lastNameId = None):
+        """See RegAPI.checkName"""
+        lastNameId = lastNameId or self.LASTNAME_RESIDENT
+        if self.nameCache:
+            result = cachedName(self.nameCache, username, lastNameId)
+            if result != None:
+                return result
+        
+        return await self.flights.do(("check_name", username.lower(), lastNameId),
+            self.requestName, username, lastNameId)
+    
+    async def requestName(self, username, lastNameId):
+        """See RegAPI.requestName"""
+        try:
+            result = await self.post("check_name",
+                RegAPI.checkNameTemplate.encode(username, lastNameId))
+        except RegAPIError as e:
+            if self.nameCache:
+                self.nameCache.set(username, lastNameId, copyError(e))
+            raise
+        
+        if self.nameCache:
+            self.nameCache.set(username, lastNameId, result)
+        
+        return result
+    
+    async def checkNames(self, candidates, lastNameId = None, concurrency = 8,
+                    stopAfter = None):
+        """See RegAPI.checkNames"""
+        candidates = list(dict.fromkeys(candidates))
+        limit = asyncio.Semaphore(concurrency)
+        
+        async def check(name):
+            async with limit:
+                try:
+                    if type(name) == tuple:
+                        return name, await self.checkName(*name)
+                    return name, await self.checkName(name, lastNameId)
+                except RegAPIError as e:
+                    return name, e
+        
+        results = {}
+        #candidates[:settled] all have results
+        settled = 0
+        available = 0
+        tasks = [asyncio.ensure_future(check(name)) for name in candidates]
+        try:
+            for task in asyncio.as_completed(tasks):
+                name, result = await task
+                results[name] = result
+                while settled < len(candidates) and candidates[settled] in results \
+                        and not (stopAfter and available >= stopAfter):
+                    if results[candidates[settled]] == True:
+                        available += 1
+                    settled += 1
+                if stopAfter and available >= stopAfter:
+                    candidates = candidates[:settled]
+                    break
+        finally:
+            for task in tasks:
+                task.cancel()
+        
+        return collections.OrderedDict((name, results[name])
+            for name in candidates if name in results)
+    
+    async def suggestNames(self, base, count = 5, lastNames = None,
+                    concurrency = 8, limit = 50):
+        """See RegAPI.suggestNames"""
+        if lastNames == None and "get_last_names" in self.capabilities:
+            lastNames = await self.getLastNames()
+        candidates = generateNameVariants(base, lastNames, limit)
+        results = await self.checkNames(candidates, concurrency = concurrency,
+            stopAfter = count)
+        return [candidate for candidate, result in results.items()
+            if result == True][:count]
+    
+    async def createUser(self, username, lastNameId = None,
+                    estate = None, region = None, location = None,
+                    lookAt = None, marketing = None, successUrl = None,
+                    errorUrl = None, maturity = None):
+        """See RegAPI.createUser"""
+        data = createUserData(username, lastNameId, estate, region, location,
+            lookAt, marketing, successUrl, errorUrl, maturity)
+        result = await self.post("create_user", llsd.llsdEncode(data))
+        if self.nameCache:
+            self.nameCache.invalidate(username, lastNameId or self.LASTNAME_RESIDENT)
+        return result
+    
+    async def regenerateUserNonce(self, agentId):
+        """See RegAPI.regenerateUserNonce"""
+        return await self.post("regenerate_user_nonce",
+            RegAPI.agentTemplate.encode(agentId))
+    
+    async def setUserAvatar(self, agentId, avatarId):
+        """See RegAPI.setUserAvatar"""
+        return await self.post("set_user_avatar",
+            RegAPI.avatarTemplate.encode(agentId, avatarId))
+    
+    async def setUserExperience(self, agentId, experienceId):
+        """See RegAPI.setUserExperience"""
+        return await self.post("set_user_experience",
+            RegAPI.experienceTemplate.encode(agentId, experienceId))
+    
+    async def addToGroup(self, username, groupName):
+        """See RegAPI.addToGroup"""
+        username = parseUsername(username)
+        return await self.post("add_to_group",
+            RegAPI.groupTemplate.encode(username[0], username[1], groupName))
@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+"""
+Name: bench.py
+Purpose: Benchmark the LLSD codecs against a reproducible corpus
+
+Copyright (c) 2021 Kyler Eastridge
+
+This software is provided 'as-is', without any express or implied
+warranty. In no event will the authors be held liable for any damages
+arising from the use of this software.
+
+Permission is granted to anyone to use this software for any purpose,
+including commercial applications, and to alter it and redistribute it
+freely, subject to the following restrictions:
+
+1. The origin of this software must not be misrepresented; you must not
+   claim that you wrote the original software. If you use this software
+   in a product, an acknowledgment in the product documentation would be
+   appreciated but is not required.
+2. Altered source versions must be plainly marked as such, and must not be
+   misrepresented as being the original software.
+3. This notice may not be removed or altered from any source distribution.
+"""
+#Usage: python -m regapi.bench [--output results.json] [--compare old.json]
+import argparse
+import datetime
+import io
+import json
+import platform
+import random
+import sys
+import time
+import tracemalloc
+import uuid
+import xml.etree.ElementTree as ET
+from . import llsd
+
+#Corpus generators, each takes a random.Random and a scale factor
+def makeUUID(rng):
+    return uuid.UUID(int = rng.getrandbits(128), version = 4)
+
+def makeWord(rng, minLength = 3, maxLength = 12):
+    return "".join(rng.choice("abcdefghijklmnopqrstuvwxyz")
+        for i in range(rng.randint(minLength, maxLength))).capitalize()
+
+def corpusCatalog(rng, scale):
+    """Like get_avatars and get_experiences, {"uuid": "name", ...}"""
+    return {str(makeUUID(rng)): "{} {}".format(makeWord(rng), makeWord(rng))
+        for i in range(200 * scale)}
+
+def corpusLastNames(rng, scale):
+    """Like get_last_names, {"id": "name", ...}"""
+    return {str(10000 + i): makeWord(rng) for i in range(200 * scale)}
+
+def corpusErrorCodes(rng, scale):
+    """Like get_error_codes, [[code, "name", "description"], ...]"""
+    return [[i, makeWord(rng), " ".join(makeWord(rng) for j in range(12))]
+        for i in range(100 * scale)]
+
+def corpusRegistration(rng, scale):
+    """Like a create_user response, a small flat map"""
+    return {
+        "agent_id": makeUUID(rng),
+        "complete_reg_url": llsd.URI("https://example.com/complete?nonce={}".format(makeUUID(rng))),
+        "username": makeWord(rng),
+        "last_name_id": 10327,
+        "marketing_emails": False,
+        "start_local_x": rng.random() * 256,
+        "created": datetime.datetime(2021, 1, 1, 12, 0, 0),
+    }
+
+def corpusDeep(rng, scale):
+    """Maps and arrays nested 64 levels deep"""
+    value = makeWord(rng)
+    for i in range(64):
+        if i % 2:
+            value = {makeWord(rng): value, "n": i}
+        else:
+            value = [value, i, rng.random()]
+    return [value] * scale
+
+def corpusBinary(rng, scale):
+    """A few large binary blobs"""
+    return {"blob{}".format(i): rng.randbytes(64 * 1024 * scale) for i in range(4)}
+
+def corpusNumeric(rng, scale):
+    """Long homogeneous numeric arrays"""
+    return {
+        "integers": [rng.randint(-2**31, 2**31 - 1) for i in range(2000 * scale)],
+        "reals": [rng.random() for i in range(2000 * scale)],
+    }
+
+corpora = {
+    "catalog": corpusCatalog,
+    "lastnames": corpusLastNames,
+    "errorcodes": corpusErrorCodes,
+    "registration": corpusRegistration,
+    "deep": corpusDeep,
+    "binary": corpusBinary,
+    "numeric": corpusNumeric,
+}
+
+def makeCorpus(names = None, seed = 0, scale = 1):
+    """Generate the named corpora, or all of them. The same seed and scale
+        always give the same values.
+    """
+    result = {}
+    for name in names or corpora:
+        result[name] = corpora[name](random.Random("{}:{}".format(seed, name)), scale)
+    return result
+
+#Code paths, each is (format, path, operation, function). Encoders take the
+#value, decoders take the encoded bytes for their format.
+def encodeElementTree(value):
+    root = ET.Element("llsd")
+    llsd.llsdEncodeXml(value, root, optimize = True)
+    f = io.BytesIO()
+    ET.ElementTree(root).write(f, encoding = "UTF-8", xml_declaration = True)
+    return f.getvalue()
+
+def decodeLazy(data):
+    #Touch one field, the case lazy decoding is meant for
+    value = llsd.llsdDecode(data, lazy = True)
+    if isinstance(value, llsd.LazyMap):
+        for key in value:
+            return value[key]
+    elif isinstance(value, llsd.LazyArray) and len(value):
+        return value[0]
+    return value
+
+paths = [
+    ("xml", "fast", "encode", lambda value: llsd.llsdEncode(value)),
+    ("xml", "elementtree", "encode", encodeElementTree),
+    ("binary", "default", "encode", lambda value: llsd.llsdEncode(value, format = "binary")),
+    ("notation", "default", "encode", lambda value: llsd.llsdEncode(value, format = "notation")),
+    ("xml", "tree", "decode", lambda data: llsd.llsdDecode(data)),
+    ("xml", "stream", "decode", lambda data: llsd.load(io.BytesIO(data))),
+    ("xml", "lazy", "decode", decodeLazy),
+    ("xml", "typed", "decode", lambda data: llsd.llsdDecode(data, typedArrays = "array")),
+    ("binary", "default", "decode", lambda data: llsd.llsdDecode(data)),
+    ("notation", "default", "decode", lambda data: llsd.llsdDecode(data)),
+]
+
+def timeCall(function, argument, number, repeat):
+    """Returns the best time per call, in seconds, over repeat rounds of
+        number calls.
+    """
+    best = None
+    for i in range(repeat):
+        start = time.perf_counter()
+        for j in range(number):
+            function(argument)
+        elapsed = (time.perf_counter() - start) / number
+        if best == None or elapsed < best:
+            best = elapsed
+    return best
+
+def traceCall(function, argument):
+    """Returns (peak bytes, allocated blocks still alive) for one call."""
+    tracemalloc.start()
+    try:
+        before = tracemalloc.take_snapshot()
+        tracemalloc.reset_peak()
+        result = function(argument)
+        peak = tracemalloc.get_traced_memory()[1]
+        after = tracemalloc.take_snapshot()
+    finally:
+        tracemalloc.stop()
+    blocks = sum(stat.count_diff for stat in after.compare_to(before, "filename"))
+    del result
+    return peak, blocks
+
+def run(names = None, seed = 0, scale = 1, number = 5, repeat = 3, log = None):
+    """Run every code path over every corpus and return the results as a
+        JSON serializable dictionary.
+    """
+    results = []
+    for name, value in makeCorpus(names, seed, scale).items():
+        encoded = {
+            "xml": llsd.llsdEncode(value),
+            "binary": llsd.llsdEncode(value, format = "binary"),
+            "notation": llsd.llsdEncode(value, format = "notation"),
+        }
+        for format, path, operation, function in paths:
+            argument = value if operation == "encode" else encoded[format]
+            seconds = timeCall(function, argument, number, repeat)
+            peak, blocks = traceCall(function, argument)
+            size = len(encoded[format])
+            result = {
+                "corpus": name,
+                "format": format,
+                "path": path,
+                "operation": operation,
+                "bytes": size,
+                "seconds": seconds,
+                "opsPerSecond": 1 / seconds if seconds else None,
+                "megabytesPerSecond": size / seconds / 1e6 if seconds else None,
+                "peakBytes": peak,
+                "allocatedBlocks": blocks,
+            }
+            results.append(result)
+            if log:
+                log("{corpus:<13} {format:<9} {path:<12} {operation:<7} "
+                    "{bytes:>10} B {megabytesPerSecond:>9.2f} MB/s "
+                    "{peakBytes:>11} B peak".format(**result))
+
+    from . import __version__
+    return {
+        "version": __version__,
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "seed": seed,
+        "scale": scale,
+        "results": results,
+    }
+
+def compare(old, new, threshold = 0.1):
+    """Compare two result sets from run(). Returns a list of regressions,
+        code paths whose time or peak memory grew by more than threshold.
+    """
+    def key(result):
+        return (result["corpus"], result["format"], result["path"], result["operation"])
+    previous = {key(result): result for result in old["results"]}
+    regressions = []
+    for result in new["results"]:
+        before = previous.get(key(result))
+        if not before:
+            continue
+        for field in ("seconds", "peakBytes"):
+            if before[field] and result[field] > before[field] * (1 + threshold):
+                regressions.append({
+                    "corpus": result["corpus"],
+                    "format": result["format"],
+                    "path": result["path"],
+                    "operation": result["operation"],
+                    "field": field,
+                    "before": before[field],
+                    "after": result[field],
+                    "change": result[field] / before[field] - 1,
+                })
+    return regressions
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(prog = "python -m regapi.bench",
+        description = "Benchmark the LLSD codecs.")
+    parser.add_argument("--corpus", action = "append", choices = sorted(corpora),
+        help = "Corpus to run, may be repeated. Defaults to all of them.")
+    parser.add_argument("--seed", type = int, default = 0)
+    parser.add_argument("--scale", type = int, default = 1,
+        help = "Multiplier for the corpus sizes.")
+    parser.add_argument("--number", type = int, default = 5,
+        help = "Calls per timing round.")
+    parser.add_argument("--repeat", type = int, default = 3,
+        help = "Timing rounds, the best is kept.")
+    parser.add_argument("--output", help = "Write the JSON results here.")
+    parser.add_argument("--compare", help = "Previous JSON results to compare against.")
+    parser.add_argument("--threshold", type = float, default = 0.1,
+        help = "Relative slowdown that counts as a regression.")
+    parser.add_argument("--quiet", action = "store_true")
+    args = parser.parse_args(argv)
+
+    log = None
+    if not args.quiet:
+        log = lambda line: print(line, file = sys.stderr)
+    results = run(args.corpus, args.seed, args.scale, args.number, args.repeat, log)
+
+    if args.compare:
+        with open(args.compare) as f:
+            results["regressions"] = compare(json.load(f), results, args.threshold)
+        for regression in results["regressions"]:
+            print("REGRESSION {corpus} {format} {path} {operation} {field}: "
+                "{before:.6g} -> {after:.6g} ({change:+.1%})".format(**regression),
+                file = sys.stderr)
+
+    output = json.dumps(results, indent = 4)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    else:
+        print(output)
+    return 1 if results.get("regressions") else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
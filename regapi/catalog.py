@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+"""
+Name: catalog.py
+Purpose: In-memory indexes of the catalog capabilities
+
+Copyright (c) 2021 Kyler Eastridge
+
+This software is provided 'as-is', without any express or implied
+warranty. In no event will the authors be held liable for any damages
+arising from the use of this software.
+
+Permission is granted to anyone to use this software for any purpose,
+including commercial applications, and to alter it and redistribute it
+freely, subject to the following restrictions:
+
+1. The origin of this software must not be misrepresented; you must not
+   claim that you wrote the original software. If you use this software
+   in a product, an acknowledgment in the product documentation would be
+   appreciated but is not required.
+2. Altered source versions must be plainly marked as such, and must not be
+   misrepresented as being the original software.
+3. This notice may not be removed or altered from any source distribution.
+"""
+import random
+import time
+import uuid
+
+def intKeys(raw):
+    """Convert the keys from strings to integers"""
+    return {int(k): v for k, v in raw.items()}
+
+def uuidKeys(raw):
+    """Convert the keys from strings to UUIDs"""
+    return {uuid.UUID(k): v for k, v in raw.items()}
+
+class Catalogs:
+    """The catalog capabilities as the server sent them, converted once and
+        indexed for constant time lookups. Every update swaps whole
+        dictionaries, so lookups are safe from any thread without a lock.
+        A cache entry is a dictionary with the server response in "data",
+        when it was fetched in "fetched", the response validators in "etag"
+        and "modified" and a random number in "jitter" that spreads out
+        refreshes, which is what gets stored in the RegAPI cache.
+    """
+    #Results of freshness()
+    FRESH = 0
+    STALE = 1
+    EXPIRED = 2
+    
+    #Capability: function converting the server response, None if the
+    #response is used as is
+    converters = {
+        "get_error_codes": None,
+        "get_last_names": intKeys,
+        "get_avatars": uuidKeys,
+        "get_experiences": uuidKeys,
+    }
+    
+    def __init__(self):
+        #Capability: cache entry
+        self.entries = {}
+        #Capability: converted response
+        self.values = {}
+        #code: (name, description)
+        self.errors = {}
+        #"lowercase name": id
+        self.lastNameIds = {}
+    
+    @staticmethod
+    def cacheKey(cap):
+        return "catalog:{}".format(cap)
+    
+    @staticmethod
+    def makeEntry(data, headers):
+        """Make a cache entry from a response and its headers."""
+        entry = {"data": data, "fetched": time.time(), "jitter": random.random()}
+        if headers.get("etag"):
+            entry["etag"] = headers["etag"]
+        if headers.get("last-modified"):
+            entry["modified"] = headers["last-modified"]
+        return entry
+    
+    @staticmethod
+    def revalidated(entry, headers):
+        """Make a new cache entry for a 304 Not Modified answer to entry."""
+        return Catalogs.makeEntry(entry["data"], {
+            "etag": headers.get("etag") or entry.get("etag"),
+            "last-modified": headers.get("last-modified") or entry.get("modified"),
+        })
+    
+    @staticmethod
+    def validators(entry):
+        """Returns the headers that make a request for entry conditional."""
+        headers = {}
+        if entry:
+            if entry.get("etag"):
+                headers["if-none-match"] = entry["etag"]
+            if entry.get("modified"):
+                headers["if-modified-since"] = entry["modified"]
+        return headers
+    
+    @staticmethod
+    def freshness(entry, ttl, maxAge = None, jitter = 0):
+        """Returns FRESH if entry can be used as is, STALE if it can be used
+            but should be revalidated, or EXPIRED if it must be revalidated
+            first. Entries are fresh for ttl seconds, cut short by up to
+            jitter of it so entries fetched together are not revalidated
+            together, and can be used stale until they are maxAge seconds
+            old. None means no limit."""
+        if ttl == None:
+            return Catalogs.FRESH
+        age = time.time() - entry.get("fetched", 0)
+        if age < ttl * (1 - jitter * entry.get("jitter", 0)):
+            return Catalogs.FRESH
+        if maxAge == None or age < maxAge:
+            return Catalogs.STALE
+        return Catalogs.EXPIRED
+    
+    def get(self, cap):
+        """Returns the converted catalog, or None if it is not loaded."""
+        return self.values.get(cap)
+    
+    def update(self, cap, entry):
+        """Load a cache entry for cap and return the converted catalog. The
+            indexes are only rebuilt if the response changed."""
+        previous = self.entries.get(cap)
+        if previous != None and previous["data"] is entry["data"]:
+            self.entries[cap] = entry
+            return self.values[cap]
+        
+        converter = self.converters.get(cap)
+        value = converter(entry["data"]) if converter else entry["data"]
+        if cap == "get_error_codes":
+            self.errors = {code[0]: (code[1], code[2]) for code in value}
+        elif cap == "get_last_names":
+            self.lastNameIds = {name.lower(): id for id, name in value.items()}
+        self.values[cap] = value
+        self.entries[cap] = entry
+        return value
+    
+    def error(self, code):
+        """Returns the (name, description) of an error code, or None."""
+        return self.errors.get(code)
+    
+    def lastName(self, id):
+        """Returns the last name for a last name id, or None."""
+        return (self.values.get("get_last_names") or {}).get(id)
+    
+    def lastNameId(self, name):
+        """Returns the id of a last name, in any case, or None."""
+        return self.lastNameIds.get(name.lower())
+    
+    def avatarName(self, id):
+        """Returns the name of a starting avatar UUID, or None."""
+        return (self.values.get("get_avatars") or {}).get(id)
+    
+    def experienceName(self, id):
+        """Returns the name of an experience UUID, or None."""
+        return (self.values.get("get_experiences") or {}).get(id)
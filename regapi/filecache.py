@@ -21,46 +21,1075 @@ freely, subject to the following restrictions:
    misrepresented as being the original software.
 3. This notice may not be removed or altered from any source distribution.
 """
-
+from . import llsd
 import tempfile
 import string
 import os
 import getpass
+import atexit
+import collections
+import hashlib
+import io
+import itertools
+import mmap
 import pickle
+import sqlite3
+import struct
+import sys
+import threading
 import time
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+#Fixed so pickled keys compare equal across Python versions
+PICKLE_PROTOCOL = 4
 
-def getPath(cacheName):
+def getPath(cacheName, extension = "fc"):
+    """The default cache file for cacheName, in the temporary directory
+        shared by every user."""
     safe = string.ascii_letters+string.digits
     safe = "".join(c for c in getpass.getuser() if c in safe).strip()
-    return os.path.join(tempfile.gettempdir(), "{}_{}.fc".format(cacheName, safe))
+    return os.path.join(tempfile.gettempdir(), "{}_{}.{}".format(cacheName, safe, extension))
 
-class FileCache:
-    def __init__(self, cacheName = "filecache", path = None, expiry = 60*60):
-        if not path:
-            path = getPath(cacheName)
+def sizeOf(value, depth = 0):
+    """Approximate memory used by value and what it contains, in bytes."""
+    size = sys.getsizeof(value)
+    if depth < 8:
+        if isinstance(value, dict):
+            size += sum(sizeOf(k, depth + 1) + sizeOf(v, depth + 1)
+                for k, v in value.items())
+        elif isinstance(value, (list, tuple, set, frozenset)):
+            size += sum(sizeOf(v, depth + 1) for v in value)
+    return size
+
+def openPrivate(path, mode):
+    """Open a file, creating it readable by the owner only."""
+    flags = os.O_RDWR | os.O_CREAT
+    if "w" in mode:
+        flags |= os.O_TRUNC
+    return os.fdopen(os.open(path, flags, 0o600), mode)
+
+class FileLock:
+    """An exclusive lock between threads and, if shared, between processes
+        through fcntl.flock on path. Reentrant, the file lock is held until
+        the outermost release.
+        The lock file also holds a generation counter that writers bump
+        after changing the cache, which is how other processes notice.
+    """
+    def __init__(self, path, shared = False):
+        if shared and fcntl == None:
+            raise ValueError("Shared mode needs fcntl!")
         self.path = path
+        self.shared = shared
+        self.lock = threading.RLock()
+        self.depth = 0
+        self.file = None
+        if shared:
+            self.file = openPrivate(path, "r+b")
+    
+    def __enter__(self):
+        self.lock.acquire()
+        if self.shared and self.depth == 0:
+            try:
+                fcntl.flock(self.file.fileno(), fcntl.LOCK_EX)
+            except BaseException:
+                self.lock.release()
+                raise
+        self.depth += 1
+        return self
+    
+    def __exit__(self, *args):
+        self.depth -= 1
+        if self.shared and self.depth == 0:
+            fcntl.flock(self.file.fileno(), fcntl.LOCK_UN)
+        self.lock.release()
+    
+    def generation(self):
+        """Returns the generation counter, 0 if not shared."""
+        if not self.shared:
+            return 0
+        data = os.pread(self.file.fileno(), 8, 0)
+        return int.from_bytes(data, "big") if len(data) == 8 else 0
+    
+    def bump(self):
+        """Increment the generation counter, with the lock held. Returns the
+            new generation."""
+        generation = self.generation() + 1
+        if self.shared:
+            os.pwrite(self.file.fileno(), generation.to_bytes(8, "big"), 0)
+        return generation
+    
+    def close(self):
+        with self.lock:
+            if self.file:
+                self.file.close()
+                self.file = None
+
+class PickleBackend:
+    """The whole cache pickled in one file, read at open and written again on
+        every change. Compatible with caches written by older versions.
+        The file is written to a temporary file and moved over the old one,
+        so readers never see half of it. If shared, writers hold a lock file
+        and merge in changes made by other processes first, and refresh()
+        reloads the file when the lock file generation moved. generation
+        goes up every time changes made elsewhere are loaded.
+    """
+    def __init__(self, path, shared = False):
+        self.path = path
+        self.shared = shared
+        self.lock = FileLock(path + ".lock", shared)
+        self.generation = 0
+        self.data = {}
+        self.load()
+    
+    def load(self):
+        #The generation is read first, a write in between only means
+        #loading again
+        self.fileGeneration = self.lock.generation()
         try:
-            with open(path, "rb", 0o600) as f:
+            with open(self.path, "rb") as f:
                 self.data = pickle.load(f)
-        except (FileNotFoundError, pickle.PickleError):
+        except (FileNotFoundError, EOFError, pickle.PickleError):
             self.data = {}
+        self.generation += 1
+    
+    def refresh(self):
+        """Load changes made by other processes, returns True if there were
+            any."""
+        if not self.shared or self.lock.generation() == self.fileGeneration:
+            return False
+        with self.lock:
+            self.load()
+        return True
+    
+    def keys(self):
+        return list(self.data)
+    
+    def read(self, key):
+        return self.data.get(key)
+    
+    def write(self, key, record):
+        self.writeMany({key: record})
+    
+    def delete(self, key):
+        self.deleteMany([key])
+    
+    def deleteMany(self, keys):
+        self.writeMany({}, keys)
+    
+    def writeMany(self, records, deletes = ()):
+        """Set every {key: record} in records and delete the keys in deletes,
+            writing the file once."""
+        with self.lock:
+            self.refresh()
+            found = [self.data.pop(key, None) for key in deletes]
+            self.data.update(records)
+            if records or any(record != None for record in found):
+                self.save()
+    
+    def save(self):
+        with self.lock:
+            temp = "{}.{}.tmp".format(self.path, os.getpid())
+            with openPrivate(temp, "wb") as f:
+                pickle.dump(self.data, f)
+            os.replace(temp, self.path)
+            self.fileGeneration = self.lock.bump()
+    
+    def flush(self):
+        #Every change is already written
+        pass
+    
+    def close(self):
+        self.lock.close()
+
+class LogBackend:
+    """An append-only log of records, each a header, the pickled key and the
+        pickled record. Opening the log only reads the keys, building an index
+        of where each record is, and writing appends one record. Deleted and
+        replaced records are dropped by a background compaction once they
+        take up more than compactRatio of the live data and compactMinimum
+        bytes.
+        If shared, appends and compactions hold a lock file, and records
+        appended by other processes are indexed before appending and on
+        refresh(). A compaction bumps the lock file generation, which makes
+        the other processes open the log again. generation goes up every
+        time changes made elsewhere are picked up.
+    """
+    MAGIC = b"FileCache log 1\n"
+    SET = 1
+    DELETE = 2
+    recordHeader = struct.Struct(">BII")
+    
+    def __init__(self, path, compactRatio = 1, compactMinimum = 1024*1024,
+                    shared = False):
+        self.path = path
+        self.compactRatio = compactRatio
+        self.compactMinimum = compactMinimum
+        self.shared = shared
+        self.lock = threading.RLock()
+        self.fileLock = FileLock(path + ".lock", shared)
+        self.compacting = None
+        self.generation = 0
+        self.file = None
+        with self.lock, self.fileLock:
+            self.open()
+    
+    def open(self):
+        #Called with both locks held
+        if self.file:
+            self.file.close()
+        self.file = openPrivate(self.path, "r+b")
+        magic = self.file.read(len(self.MAGIC))
+        if magic != self.MAGIC:
+            #New or unreadable, start over
+            self.file.seek(0)
+            self.file.truncate()
+            self.file.write(self.MAGIC)
+            self.file.flush()
+        self.fileGeneration = self.fileLock.generation()
+        #key: (record offset, value offset, value length)
+        self.index = {}
+        end = self.scan(self.file, len(self.MAGIC), self.index)
+        self.file.truncate(end)
+        self.size = end
+        self.live = self.liveSize(self.index)
+        self.generation += 1
+    
+    @classmethod
+    def scan(cls, f, offset, index, start = None):
+        """Read records from f, starting at start, into index. Offsets in f
+            start at offset. Returns the offset after the last whole record,
+            a torn write at the end is left out. Values are skipped."""
+        header = cls.recordHeader
+        if start == None:
+            start = offset
+        end = f.seek(0, 2) - start + offset
+        f.seek(start)
+        while True:
+            data = f.read(header.size)
+            if len(data) < header.size:
+                return offset
+            op, keyLength, valueLength = header.unpack(data)
+            key = f.read(keyLength)
+            valueOffset = offset + header.size + keyLength
+            if len(key) < keyLength or valueOffset + valueLength > end:
+                return offset
+            f.seek(valueLength, 1)
+            key = pickle.loads(key)
+            if op == cls.SET:
+                index[key] = (offset, valueOffset, valueLength)
+            else:
+                index.pop(key, None)
+            offset = valueOffset + valueLength
+    
+    @staticmethod
+    def liveSize(index):
+        return sum(valueOffset + valueLength - offset
+            for offset, valueOffset, valueLength in index.values())
+    
+    def catchUp(self):
+        """Index what other processes appended, or reopen the log if one of
+            them compacted it. Called with both locks held, returns True if
+            anything changed."""
+        if self.fileLock.generation() != self.fileGeneration:
+            self.open()
+            return True
+        if os.fstat(self.file.fileno()).st_size == self.size:
+            return False
+        size = self.scan(self.file, self.size, self.index)
+        #Nobody is appending while we hold the lock, anything past the last
+        #whole record was torn by a crash
+        self.file.truncate(size)
+        changed = size != self.size
+        self.size = size
+        if changed:
+            self.live = self.liveSize(self.index)
+            self.generation += 1
+        return changed
+    
+    def refresh(self):
+        """Index records appended by other processes, returns True if there
+            were any."""
+        if not self.shared:
+            return False
+        if self.fileLock.generation() == self.fileGeneration \
+                and os.fstat(self.file.fileno()).st_size == self.size:
+            return False
+        with self.lock, self.fileLock:
+            return self.catchUp()
+    
+    def keys(self):
+        with self.lock:
+            return list(self.index)
+    
+    def read(self, key):
+        with self.lock:
+            location = self.index.get(key)
+            if location == None:
+                return None
+            self.file.seek(location[1])
+            data = self.file.read(location[2])
+        return pickle.loads(data)
+    
+    def append(self, op, key, value = b""):
+        #Called with both locks held
+        if self.shared:
+            self.catchUp()
+        key = pickle.dumps(key, PICKLE_PROTOCOL)
+        data = self.recordHeader.pack(op, len(key), len(value)) + key + value
+        offset = self.size
+        self.file.seek(offset)
+        self.file.write(data)
+        self.file.flush()
+        self.size += len(data)
+        return offset, offset + len(data) - len(value), len(value)
+    
+    def write(self, key, record):
+        self.writeMany({key: record})
+    
+    def delete(self, key):
+        self.deleteMany([key])
+    
+    def deleteMany(self, keys):
+        self.writeMany({}, keys)
+    
+    def writeMany(self, records, deletes = ()):
+        """Set every {key: record} in records and delete the keys in deletes,
+            holding the locks once."""
+        values = [(key, pickle.dumps(record, PICKLE_PROTOCOL))
+            for key, record in records.items()]
+        with self.lock, self.fileLock:
+            for key in deletes:
+                if self.shared:
+                    self.catchUp()
+                previous = self.index.pop(key, None)
+                if previous:
+                    self.append(self.DELETE, key)
+                    self.live -= previous[1] + previous[2] - previous[0]
+            for key, value in values:
+                location = self.append(self.SET, key, value)
+                previous = self.index.get(key)
+                if previous:
+                    self.live -= previous[1] + previous[2] - previous[0]
+                self.index[key] = location
+                self.live += location[1] + location[2] - location[0]
+            self.maybeCompact()
+    
+    def maybeCompact(self):
+        garbage = self.size - len(self.MAGIC) - self.live
+        if self.compacting == None and garbage > self.compactMinimum \
+                and garbage > self.live * self.compactRatio:
+            self.compacting = threading.Thread(target = self.compact,
+                daemon = True, name = "FileCache compaction")
+            self.compacting.start()
+    
+    def compact(self):
+        """Rewrite the log with only the live records. Records are copied
+            without the lock, the log being append-only, then whatever was
+            appended meanwhile is copied under it and the files swapped."""
+        temp = "{}.{}.compact".format(self.path, os.getpid())
+        try:
+            with self.lock, self.fileLock:
+                self.file.flush()
+                snapshot = dict(self.index)
+                end = self.size
+                generation = self.fileGeneration
+                #Opened under the lock, so it is the file the snapshot is of
+                source = open(self.path, "rb")
+            index = {}
+            with source, openPrivate(temp, "wb") as destination:
+                destination.write(self.MAGIC)
+                offset = len(self.MAGIC)
+                for key, (recordOffset, valueOffset, valueLength) in snapshot.items():
+                    source.seek(recordOffset)
+                    data = source.read(valueOffset + valueLength - recordOffset)
+                    destination.write(data)
+                    index[key] = (offset, offset + valueOffset - recordOffset, valueLength)
+                    offset += len(data)
+                
+                with self.lock, self.fileLock:
+                    if self.shared:
+                        self.catchUp()
+                    if self.fileGeneration != generation:
+                        #Another process compacted it first
+                        return
+                    source.seek(end)
+                    tail = source.read(self.size - end)
+                    destination.write(tail)
+                    destination.flush()
+                    os.fsync(destination.fileno())
+                    self.scan(io.BytesIO(tail), offset, index, 0)
+                    os.replace(temp, self.path)
+                    self.file.close()
+                    self.file = open(self.path, "r+b")
+                    self.fileGeneration = self.fileLock.bump()
+                    self.index = index
+                    self.size = offset + len(tail)
+                    self.live = self.liveSize(index)
+        finally:
+            self.compacting = None
+            if os.path.exists(temp):
+                os.remove(temp)
+    
+    def flush(self):
+        with self.lock:
+            self.file.flush()
+            os.fsync(self.file.fileno())
+    
+    def close(self):
+        compacting = self.compacting
+        if compacting:
+            compacting.join()
+        with self.lock:
+            self.file.close()
+        self.fileLock.close()
+
+class SQLiteBackend:
+    """A sqlite3 database in WAL mode, one row per key. Readers never block
+        the writer, and other processes can always use the same file, shared
+        only turns on refresh(). generation goes up every time refresh()
+        finds changes made by other processes.
+    """
+    def __init__(self, path, timeout = 30, shared = False):
+        self.path = path
+        self.shared = shared
+        self.generation = 0
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, timeout = timeout,
+            isolation_level = None, check_same_thread = False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS cache "
+            "(key BLOB PRIMARY KEY, value BLOB NOT NULL)")
+        self.version = self.dataVersion()
+    
+    def dataVersion(self):
+        #Changes when another connection commits
+        return self.connection.execute("PRAGMA data_version").fetchone()[0]
+    
+    def refresh(self):
+        """Returns True if other processes changed the database."""
+        if not self.shared:
+            return False
+        with self.lock:
+            version = self.dataVersion()
+            if version == self.version:
+                return False
+            self.version = version
+            self.generation += 1
+        return True
+    
+    def keys(self):
+        with self.lock:
+            rows = self.connection.execute("SELECT key FROM cache").fetchall()
+        return [pickle.loads(row[0]) for row in rows]
+    
+    def read(self, key):
+        with self.lock:
+            row = self.connection.execute("SELECT value FROM cache WHERE key = ?",
+                (pickle.dumps(key, PICKLE_PROTOCOL),)).fetchone()
+        if row == None:
+            return None
+        return pickle.loads(row[0])
+    
+    def write(self, key, record):
+        key = pickle.dumps(key, PICKLE_PROTOCOL)
+        value = pickle.dumps(record, PICKLE_PROTOCOL)
+        with self.lock:
+            self.connection.execute("INSERT OR REPLACE INTO cache (key, value) "
+                "VALUES (?, ?)", (key, value))
+    
+    def delete(self, key):
+        self.deleteMany([key])
+    
+    def deleteMany(self, keys):
+        self.writeMany({}, keys)
+    
+    def writeMany(self, records, deletes = ()):
+        """Set every {key: record} in records and delete the keys in deletes,
+            in one transaction."""
+        deletes = [(pickle.dumps(key, PICKLE_PROTOCOL),) for key in deletes]
+        rows = [(pickle.dumps(key, PICKLE_PROTOCOL), pickle.dumps(record, PICKLE_PROTOCOL))
+            for key, record in records.items()]
+        with self.lock:
+            self.connection.execute("BEGIN")
+            try:
+                self.connection.executemany("DELETE FROM cache WHERE key = ?", deletes)
+                self.connection.executemany("INSERT OR REPLACE INTO cache (key, value) "
+                    "VALUES (?, ?)", rows)
+            except BaseException:
+                self.connection.execute("ROLLBACK")
+                raise
+            self.connection.execute("COMMIT")
+    
+    def flush(self):
+        pass
+    
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+class MappedBackend:
+    """A versioned file read through mmap, so opening it only reads the
+        header and a read decodes only the record asked for. Records are LLSD
+        binary, keys must be strings and values must be LLSD, nothing in the
+        file is ever unpickled.
+        The file is a header, then each key followed by its record, then a
+        hash table of (key hash, record offset, record length, key length)
+        slots with linear probing. Every change writes a new file, copying
+        the unchanged records as they are, and moves it over the old one, so
+        writes cost as much as the whole cache. Suits caches that are read
+        far more than written, batch changes with writeMany and deleteMany
+        or FileCache's writeBehind.
+        If shared, writers hold a lock file and start from the newest file,
+        and refresh() maps the file again when the lock file generation
+        moved. generation goes up every time it is.
+    """
+    MAGIC = b"RegAPIfc"
+    VERSION = 1
+    #Magic, version, reserved, generation, table offset, slots, records
+    header = struct.Struct(">8sHHQQII")
+    slot = struct.Struct(">QQII")
+    
+    def __init__(self, path, shared = False):
+        self.path = path
+        self.shared = shared
+        self.lock = threading.RLock()
+        #Held while a new file is written, readers only wait for the swap
+        self.writeLock = threading.Lock()
+        self.fileLock = FileLock(path + ".lock", shared)
+        self.generation = 0
+        self.load()
+    
+    def load(self):
+        #Readers may still be decoding from the previous map, it is closed
+        #once they drop it
+        self.map = None
+        self.seen = self.fileLock.generation()
+        self.fileGeneration = 0
+        self.tableOffset = self.slots = self.count = 0
+        try:
+            f = open(self.path, "rb")
+        except FileNotFoundError:
+            return
+        with f:
+            if os.fstat(f.fileno()).st_size < self.header.size:
+                return
+            map = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+        magic, version, reserved, generation, tableOffset, slots, count = \
+            self.header.unpack_from(map, 0)
+        if magic != self.MAGIC or version != self.VERSION \
+                or tableOffset + slots * self.slot.size > len(map):
+            #Not ours, or a newer version, replaced on the next write
+            return
+        self.map = map
+        self.fileGeneration = generation
+        self.tableOffset = tableOffset
+        self.slots = slots
+        self.count = count
+    
+    def refresh(self):
+        """Map the file again if another process replaced it, returns True if
+            it did."""
+        if not self.shared or self.fileLock.generation() == self.seen:
+            return False
+        with self.lock:
+            self.load()
+            self.generation += 1
+        return True
+    
+    @staticmethod
+    def hashKey(key):
+        return int.from_bytes(hashlib.blake2b(key, digest_size = 8).digest(), "big")
+    
+    def entries(self):
+        """Yield (key bytes, record offset, record length) for every record."""
+        map = self.map
+        if map == None:
+            return
+        for i in range(self.slots):
+            keyHash, offset, length, keyLength = self.slot.unpack_from(map,
+                self.tableOffset + i * self.slot.size)
+            if offset:
+                yield map[offset - keyLength:offset], offset, length
+    
+    def find(self, map, key):
+        #Returns (record offset, record length) or None
+        key = key.encode()
+        keyHash = self.hashKey(key)
+        mask = self.slots - 1
+        i = keyHash & mask
+        while True:
+            slotHash, offset, length, keyLength = self.slot.unpack_from(map,
+                self.tableOffset + i * self.slot.size)
+            if offset == 0:
+                return None
+            if slotHash == keyHash and keyLength == len(key) \
+                    and map[offset - keyLength:offset] == key:
+                return offset, length
+            i = (i + 1) & mask
+    
+    def keys(self):
+        with self.lock:
+            return [str(key, "utf-8") for key, offset, length in self.entries()]
+    
+    def read(self, key):
+        with self.lock:
+            map = self.map
+            if map == None or type(key) != str:
+                return None
+            location = self.find(map, key)
+        if location == None:
+            return None
+        view = memoryview(map)
+        try:
+            return llsd.llsdDecodeBinaryValue(view, location[0])[0]
+        finally:
+            view.release()
+    
+    def write(self, key, record):
+        self.writeMany({key: record})
+    
+    def delete(self, key):
+        self.deleteMany([key])
+    
+    def deleteMany(self, keys):
+        self.writeMany({}, keys)
+    
+    def encode(self, key, record):
+        """Returns key and record as bytes, raises ValueError if the key is
+            not a string or the record is not LLSD."""
+        if type(key) != str:
+            raise ValueError("Keys must be strings!")
+        value = bytearray()
+        llsd.llsdEncodeBinary(record, value)
+        return key.encode(), value
+    
+    def writeMany(self, records, deletes = ()):
+        """Set every {key: record} in records and delete the keys in deletes,
+            writing the file once. Nothing is written if any record cannot
+            be encoded."""
+        records = dict(self.encode(key, record) for key, record in records.items())
+        with self.writeLock, self.fileLock:
+            self.refresh()
+            deletes = set(key.encode() for key in deletes if type(key) == str)
+            if not records and not any(self.find(self.map, str(key, "utf-8"))
+                    for key in deletes if self.map != None):
+                return
+            self.rewrite(records, deletes)
+    
+    def rewrite(self, records, deletes):
+        #Called with writeLock and fileLock held, records are {key: value}
+        #and deletes keys, already encoded
+        temp = "{}.{}.tmp".format(self.path, os.getpid())
+        table = []
+        with openPrivate(temp, "wb") as f:
+            offset = self.header.size
+            f.write(bytes(offset))
+            for key, recordOffset, length in self.entries():
+                if key in records or key in deletes:
+                    continue
+                f.write(self.map[recordOffset - len(key):recordOffset + length])
+                table.append((key, offset + len(key), length))
+                offset += len(key) + length
+            for key, value in records.items():
+                f.write(key)
+                f.write(value)
+                table.append((key, offset + len(key), len(value)))
+                offset += len(key) + len(value)
+            
+            slots = 8
+            while slots < len(table) * 2:
+                slots *= 2
+            mask = slots - 1
+            hashTable = bytearray(slots * self.slot.size)
+            for key, recordOffset, length in table:
+                keyHash = self.hashKey(key)
+                i = keyHash & mask
+                while self.slot.unpack_from(hashTable, i * self.slot.size)[1]:
+                    i = (i + 1) & mask
+                self.slot.pack_into(hashTable, i * self.slot.size, keyHash,
+                    recordOffset, length, len(key))
+            f.write(hashTable)
+            f.seek(0)
+            f.write(self.header.pack(self.MAGIC, self.VERSION, 0,
+                self.fileGeneration + 1, offset, slots, len(table)))
+            f.flush()
+            if self.shared:
+                os.fsync(f.fileno())
+        with self.lock:
+            os.replace(temp, self.path)
+            self.fileLock.bump()
+            self.load()
+    
+    def flush(self):
+        pass
+    
+    def close(self):
+        with self.lock:
+            self.map = None
+        self.fileLock.close()
+
+#Backend name: (class, file extension)
+backends = {
+    "mapped": (MappedBackend, "fcm"),
+    "pickle": (PickleBackend, "fc"),
+    "log": (LogBackend, "fcl"),
+    "sqlite": (SQLiteBackend, "fcdb"),
+}
+
+class FileCache:
+    """A persistent cache of {key: value}. backend is "pickle", "log",
+        "sqlite", "mapped" or a backend object, values are read from it the
+        first time they are asked for. The default "pickle" backend reads
+        and writes the same .fc file as older versions, but writes the whole
+        file on every change, "log" writes only the change to a .fcl file.
+        Switching backends starts from an empty cache, the old file is not
+        read. The "mapped" backend needs string keys and LLSD values and
+        set() raises ValueError for anything else, the others take anything
+        pickle does.
+        The pickle, log and sqlite backends unpickle what they read, and the
+        default path is in the shared temporary directory, so a local user
+        who creates that file first can run code in this process. Where
+        that matters, pass a path in a private directory or use "mapped",
+        which never unpickles.
+        Entries expire expiry seconds after they are set, unless set() is
+        given another ttl. An expiry or ttl of 0, or an expiry of None,
+        means never. Expired entries are dropped when they are read, and
+        every sweepInterval seconds by a background thread if it is given.
+        maxEntries caps the number of entries, the least recently used are
+        dropped to make room. maxBytes caps the approximate memory used by
+        values, the least recently used are unloaded and read again from the
+        backend when needed.
+        Dropped entries are removed from the backend deleteBatch at a time,
+        or on write() and close(). If shared, delete() removes the entry
+        from the backend at once.
+        If shared, several processes can use the same file at once, each
+        seeing what the others set. Needs fcntl for the pickle and log
+        backends.
+        If writeBehind is given, set() and deletes only change memory and a
+        background thread writes the changes in one batch writeBehind
+        seconds after the first one, or as soon as maxDirty are waiting.
+        Whatever is left is written by write(), close(), leaving a with
+        block and at exit. Changes not written yet are lost if the process
+        is killed, and other processes sharing the file only see them once
+        they are written.
+    """
+    def __init__(self, cacheName = "filecache", path = None, expiry = 60*60,
+                    backend = "pickle", maxEntries = None, maxBytes = None,
+                    sweepInterval = None, deleteBatch = 64, shared = False,
+                    writeBehind = None, maxDirty = 256):
+        if type(backend) == str:
+            if backend not in backends:
+                raise ValueError("Unknown backend {}!".format(backend))
+            backendClass, extension = backends[backend]
+            if not path:
+                path = getPath(cacheName, extension)
+            backend = backendClass(path, shared = shared)
+        self.path = backend.path
+        self.backend = backend
+        self.expiry = expiry
+        self.maxEntries = maxEntries
+        self.maxBytes = maxBytes
+        self.deleteBatch = deleteBatch
+        self.shared = shared
+        self.writeBehind = writeBehind
+        self.maxDirty = maxDirty
+        self.lock = threading.RLock()
+        #Keys waiting to be deleted from the backend
+        self.deleted = set()
+        #key: record, set but not written to the backend yet
+        self.dirty = {}
+        #The records and deletes being written right now
+        self.writing = {}
+        self.deleting = set()
+        #Held while writing to the backend, so batches go in order
+        self.writeLock = threading.Lock()
+        #When the oldest change that is not written yet was made
+        self.dirtySince = None
+        with self.lock:
+            self.reload()
+        
+        self.sweeper = None
+        if sweepInterval:
+            self.sweeper = threading.Event()
+            threading.Thread(target = self.sweepLoop, args = (sweepInterval,),
+                daemon = True, name = "FileCache sweeper").start()
+        
+        self.writer = None
+        if writeBehind:
+            self.changed = threading.Condition(self.lock)
+            self.closing = False
+            self.writer = threading.Thread(target = self.writeLoop, daemon = True,
+                name = "FileCache writer")
+            self.writer.start()
+            atexit.register(self.close)
+    
+    def reload(self):
+        """Forget what is in memory and list the keys in the backend again."""
+        #key: record, or None if it is only in the backend. Least recently
+        #used first.
+        self.data = collections.OrderedDict((key, None) for key in self.backend.keys()
+            if key not in self.deleted and key not in self.deleting)
+        #key: approximate size, of the records in data
+        self.sizes = {}
+        self.bytes = 0
+        #key: time it expires, for the records that do
+        self.expires = {}
+        #Keys whose expiry is not known yet
+        self.unchecked = set(self.data)
+        self.generation = getattr(self.backend, "generation", 0)
+        #Changes not in the backend yet still count
+        for key, record in itertools.chain(self.writing.items(), self.dirty.items()):
+            if key not in self.deleted:
+                self.load(key, record)
+        self.evict()
+    
+    def refresh(self):
+        """Pick up changes other processes made, in shared mode."""
+        if self.shared:
+            with self.lock:
+                self.backend.refresh()
+                if self.backend.generation != self.generation:
+                    self.reload()
     
     def write(self):
-        with open(self.path, "wb", 0o600) as f:
-            pickle.dump(self.data, f)
+        """Write every change still waiting to the backend."""
+        if not self.writeBehind:
+            with self.lock:
+                self.flushDeletes()
+                self.backend.flush()
+            return
+        
+        with self.writeLock:
+            with self.lock:
+                records, self.dirty = self.dirty, {}
+                deletes, self.deleted = self.deleted, set()
+                self.writing = records
+                self.deleting = deletes
+                self.dirtySince = None
+            try:
+                if records or deletes:
+                    if hasattr(self.backend, "writeMany"):
+                        self.backend.writeMany(records, list(deletes))
+                    else:
+                        for key, record in records.items():
+                            self.backend.write(key, record)
+                        self.backend.deleteMany(list(deletes))
+                self.backend.flush()
+            except BaseException:
+                #Put back whatever was not changed again since, for the next try
+                with self.lock:
+                    for key, record in records.items():
+                        if key not in self.deleted:
+                            self.dirty.setdefault(key, record)
+                    self.deleted.update(key for key in deletes if key not in self.dirty)
+                    self.markDirty()
+                raise
+            finally:
+                with self.lock:
+                    self.writing = {}
+                    self.deleting = set()
+    
+    def markDirty(self):
+        #Called with the lock held, in write behind mode. Wakes the writer
+        #to start the delay, or to write now once maxDirty are waiting.
+        if self.dirtySince == None:
+            self.dirtySince = time.monotonic()
+            self.changed.notify()
+        elif len(self.dirty) + len(self.deleted) >= self.maxDirty:
+            self.changed.notify()
+    
+    def writeLoop(self):
+        while True:
+            with self.lock:
+                while not self.closing:
+                    if self.dirtySince == None:
+                        self.changed.wait()
+                        continue
+                    remaining = self.dirtySince + self.writeBehind - time.monotonic()
+                    if remaining <= 0 or len(self.dirty) + len(self.deleted) >= self.maxDirty:
+                        break
+                    self.changed.wait(remaining)
+                if self.closing:
+                    return
+            try:
+                self.write()
+            except Exception:
+                #The changes are kept, and tried again after another delay
+                pass
     
-    def set(self, key, value):
-        self.data[key] = {
-            "updated": time.time(),
+    def set(self, key, value, ttl = None):
+        """Store value under key. It expires after ttl seconds, or the expiry
+            given to the cache if ttl is None. A ttl of 0 never expires."""
+        now = time.time()
+        if ttl == None:
+            ttl = self.expiry
+        record = {
+            "updated": now,
             "data": value
         }
-        self.write()
+        if ttl:
+            record["expires"] = now + ttl
+        with self.lock:
+            #Written or checked first, so a record the backend cannot store
+            #never makes it into memory
+            if self.writeBehind:
+                if hasattr(self.backend, "encode"):
+                    self.backend.encode(key, record)
+                self.dirty[key] = record
+                self.markDirty()
+            else:
+                self.backend.write(key, record)
+            self.deleted.discard(key)
+            self.load(key, record)
+            self.evict()
     
     def get(self, key, default = None, expires = None):
-        tmp = self.data.get(key, {"updated": 0, "data": default})
-        if expires and tmp["updated"] > time.now() - expires:
-            del tmp[key]
-            self.write()
-            return default
-        return tmp["data"]
-
+        """Returns the value of key, or default if there is none or it has
+            expired. expires also treats the value as expired if it was set
+            more than that many seconds ago."""
+        with self.lock:
+            self.refresh()
+            if key not in self.data:
+                return default
+            record = self.data[key]
+            if record == None:
+                record = self.stored(key)
+                if record == None:
+                    del self.data[key]
+                    self.unchecked.discard(key)
+                    return default
+                self.load(key, record)
+            
+            now = time.time()
+            if record.get("expires", now + 1) <= now \
+                    or (expires and record["updated"] <= now - expires):
+                self.remove(key)
+                return default
+            self.data.move_to_end(key)
+            if self.maxBytes:
+                self.evict()
+            return record["data"]
+    
+    def stored(self, key):
+        #The record for key waiting to be written, or the one in the backend
+        record = self.dirty.get(key)
+        if record == None:
+            record = self.writing.get(key)
+        if record == None:
+            record = self.backend.read(key)
+        return record
+    
+    def load(self, key, record):
+        #Put a record in memory, as the most recently used
+        self.data[key] = record
+        self.data.move_to_end(key)
+        if self.maxBytes:
+            #Only tracked when there is a cap, sizeOf walks the whole value
+            self.bytes -= self.sizes.pop(key, 0)
+            size = sizeOf(record["data"])
+            self.sizes[key] = size
+            self.bytes += size
+        self.unchecked.discard(key)
+        if record.get("expires"):
+            self.expires[key] = record["expires"]
+        else:
+            self.expires.pop(key, None)
+    
+    def remove(self, key):
+        #Drop a key, the backend delete is batched
+        if key in self.data:
+            del self.data[key]
+        self.bytes -= self.sizes.pop(key, 0)
+        self.expires.pop(key, None)
+        self.unchecked.discard(key)
+        self.dirty.pop(key, None)
+        self.deleted.add(key)
+        if self.writeBehind:
+            self.markDirty()
+        elif len(self.deleted) >= self.deleteBatch:
+            self.flushDeletes()
+    
+    def evict(self):
+        #Drop the least recently used entries past maxEntries, and unload
+        #values past maxBytes
+        if self.maxEntries:
+            while len(self.data) > self.maxEntries:
+                self.remove(next(iter(self.data)))
+        if self.maxBytes and self.bytes > self.maxBytes:
+            for key, record in self.data.items():
+                if self.bytes <= self.maxBytes:
+                    break
+                if record != None:
+                    self.data[key] = None
+                    self.bytes -= self.sizes.pop(key)
+    
+    def flushDeletes(self):
+        if self.deleted:
+            self.backend.deleteMany(list(self.deleted))
+            self.deleted.clear()
+    
+    def sweep(self, batch = 256):
+        """Drop every expired entry. The expiry of entries that were never
+            read is looked up batch at a time, releasing the lock between."""
+        now = time.time()
+        with self.lock:
+            self.refresh()
+            for key in [key for key, expires in self.expires.items() if expires <= now]:
+                self.remove(key)
+        while True:
+            with self.lock:
+                keys = list(itertools.islice(self.unchecked, batch))
+                for key in keys:
+                    self.unchecked.discard(key)
+                    record = self.stored(key)
+                    if record == None:
+                        self.data.pop(key, None)
+                    elif record.get("expires", now + 1) <= now:
+                        self.remove(key)
+                    elif record.get("expires"):
+                        self.expires[key] = record["expires"]
+            if len(keys) < batch:
+                break
+        if not self.writeBehind:
+            with self.lock:
+                self.flushDeletes()
+    
+    def sweepLoop(self, interval):
+        stop = self.sweeper
+        while not stop.wait(interval):
+            self.sweep()
+    
+    def delete(self, key):
+        with self.lock:
+            self.remove(key)
+            if self.shared and not self.writeBehind:
+                #Other processes see it at once, the same as a set()
+                self.flushDeletes()
+    
+    def keys(self):
+        with self.lock:
+            self.refresh()
+            return list(self.data)
+    
+    def close(self):
+        if self.sweeper:
+            self.sweeper.set()
+        if self.writer:
+            with self.lock:
+                self.closing = True
+                self.changed.notify()
+            self.writer.join()
+            self.writer = None
+            atexit.unregister(self.close)
+        self.write()
+        self.backend.close()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *args):
+        self.close()
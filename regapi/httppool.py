@@ -0,0 +1,384 @@
+#!/usr/bin/env python3
+"""
+Name: httppool.py
+Purpose: Keep-alive HTTP connection pool
+
+Copyright (c) 2021 Kyler Eastridge
+
+This software is provided 'as-is', without any express or implied
+warranty. In no event will the authors be held liable for any damages
+arising from the use of this software.
+
+Permission is granted to anyone to use this software for any purpose,
+including commercial applications, and to alter it and redistribute it
+freely, subject to the following restrictions:
+
+1. The origin of this software must not be misrepresented; you must not
+   claim that you wrote the original software. If you use this software
+   in a product, an acknowledgment in the product documentation would be
+   appreciated but is not required.
+2. Altered source versions must be plainly marked as such, and must not be
+   misrepresented as being the original software.
+3. This notice may not be removed or altered from any source distribution.
+"""
+import asyncio
+import http.client
+import io
+import select
+import ssl
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+#Requests that are safe to send again if a reused connection fails, as the
+#server may have acted on the first one before the connection dropped
+IDEMPOTENT_METHODS = ("GET", "HEAD", "OPTIONS", "PUT", "DELETE", "TRACE")
+
+class PooledResponse:
+    """A HTTP response whose connection goes back to the pool once the body
+        has been read in full and the response is closed. Behaves like the
+        objects returned by urlopen, whatever the status code.
+    """
+    def __init__(self, pool, key, connection, response, url):
+        self.pool = pool
+        self.key = key
+        self.connection = connection
+        self.response = response
+        self.url = url
+        self.status = self.code = response.status
+        self.reason = self.msg = response.reason
+        self.headers = response.headers
+    
+    @property
+    def length(self):
+        """Bytes of the body left to read, None if not known."""
+        return self.response.length
+    
+    def read(self, *args):
+        return self.response.read(*args)
+    
+    def readinto(self, buffer):
+        return self.response.readinto(buffer)
+    
+    def peek(self, *args):
+        return self.response.peek(*args)
+    
+    def getheader(self, name, default = None):
+        return self.response.getheader(name, default)
+    
+    def getheaders(self):
+        return self.response.getheaders()
+    
+    def getcode(self):
+        return self.status
+    
+    def geturl(self):
+        return self.url
+    
+    def info(self):
+        return self.headers
+    
+    def close(self):
+        connection = self.connection
+        if connection == None:
+            return
+        self.connection = None
+        response = self.response
+        if response.length == 0 and not response.isclosed():
+            #Nothing left to read, such as a 304, this only marks it done
+            response.read()
+        if response.isclosed() and not response.will_close:
+            self.pool.release(self.key, connection)
+        else:
+            #Unread body or the server is closing, the connection can't be reused
+            response.close()
+            connection.close()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *args):
+        self.close()
+
+class ConnectionPool:
+    """Keeps HTTP and HTTPS connections open per host, so repeat requests skip
+        the TCP connect and TLS handshake. Safe to share between threads.
+        maxSize is the number of idle connections kept per host, connections
+        idle for longer than idleTimeout seconds are closed instead of reused.
+        context is the ssl.SSLContext for HTTPS, a default context is used if
+        it is not given.
+        Unlike urlopen, redirects are not followed and proxies are not used.
+    """
+    def __init__(self, maxSize = 10, idleTimeout = 30, timeout = 30, context = None):
+        self.maxSize = maxSize
+        self.idleTimeout = idleTimeout
+        self.timeout = timeout
+        self.context = context or ssl.create_default_context()
+        self.lock = threading.Lock()
+        #(scheme, host, port): [(connection, last used), ...]
+        self.idle = {}
+    
+    def connect(self, key):
+        scheme, host, port = key
+        if scheme == "https":
+            return http.client.HTTPSConnection(host, port,
+                timeout = self.timeout, context = self.context)
+        return http.client.HTTPConnection(host, port, timeout = self.timeout)
+    
+    def acquire(self, key):
+        """Returns (connection, reused) for key, reusing an idle connection
+            if there is one.
+        """
+        now = time.monotonic()
+        stale = []
+        connection = None
+        with self.lock:
+            idle = self.idle.get(key)
+            while idle:
+                candidate, lastUsed = idle.pop()
+                if now - lastUsed < self.idleTimeout and candidate.sock != None \
+                        and not select.select([candidate.sock], [], [], 0)[0]:
+                    #Readable while idle means the server closed it
+                    connection = candidate
+                    break
+                stale.append(candidate)
+        for candidate in stale:
+            candidate.close()
+        if connection:
+            return connection, True
+        return self.connect(key), False
+    
+    def release(self, key, connection):
+        """Return a connection with no outstanding response to the pool."""
+        with self.lock:
+            idle = self.idle.setdefault(key, [])
+            if len(idle) < self.maxSize:
+                idle.append((connection, time.monotonic()))
+                return
+        connection.close()
+    
+    def request(self, request, data = None):
+        """Send request, a URL or urllib.request.Request, and return a
+            PooledResponse. HTTP error statuses are returned, not raised.
+            Connection failures raise urllib.error.URLError, like urlopen.
+            Only methods in IDEMPOTENT_METHODS are retried when a reused
+            connection turns out to be closed.
+        """
+        if type(request) == str:
+            request = urllib.request.Request(request, data = data)
+        elif data != None:
+            request.data = data
+        url = urllib.parse.urlsplit(request.full_url)
+        scheme = url.scheme.lower()
+        if scheme not in ("http", "https"):
+            raise urllib.error.URLError("Unsupported scheme {}".format(scheme))
+        key = (scheme, url.hostname, url.port or (443 if scheme == "https" else 80))
+        headers = dict(request.header_items())
+        method = request.get_method()
+        
+        #A pooled connection may have been closed by the server while idle,
+        #in which case an idempotent request is retried once on a new
+        #connection. Others may have been acted on, so the error is raised.
+        while True:
+            connection, reused = self.acquire(key)
+            try:
+                connection.request(method, request.selector, request.data, headers)
+                response = connection.getresponse()
+            except (http.client.RemoteDisconnected, ConnectionResetError,
+                    BrokenPipeError) as e:
+                connection.close()
+                if reused and method in IDEMPOTENT_METHODS:
+                    continue
+                raise urllib.error.URLError(e)
+            except (OSError, http.client.HTTPException) as e:
+                connection.close()
+                raise urllib.error.URLError(e)
+            except BaseException:
+                connection.close()
+                raise
+            return PooledResponse(self, key, connection, response, request.full_url)
+    
+    def close(self):
+        """Close every idle connection."""
+        with self.lock:
+            idle = self.idle
+            self.idle = {}
+        for connections in idle.values():
+            for connection, lastUsed in connections:
+                connection.close()
+
+class AsyncResponse:
+    """A HTTP response read in full by AsyncConnectionPool."""
+    def __init__(self, url, status, reason, headers, body):
+        self.url = url
+        self.status = self.code = status
+        self.reason = reason
+        self.headers = headers
+        self.body = body
+    
+    def read(self):
+        return self.body
+    
+    def getheader(self, name, default = None):
+        return self.headers.get(name, default)
+
+class AsyncConnection:
+    """A HTTP/1.1 connection over asyncio streams."""
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.lastUsed = time.monotonic()
+    
+    def close(self):
+        self.writer.close()
+    
+    async def request(self, method, host, selector, headers, body):
+        """Send a request and read the response.
+            Returns (status, reason, headers, body, keep alive).
+        """
+        lines = ["{} {} HTTP/1.1".format(method, selector), "Host: {}".format(host)]
+        for name, value in headers.items():
+            lines.append("{}: {}".format(name, value))
+        if body != None or method in ("POST", "PUT"):
+            lines.append("Content-Length: {}".format(len(body or b"")))
+        self.writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1"))
+        if body:
+            self.writer.write(body)
+        await self.writer.drain()
+        
+        reader = self.reader
+        head = await reader.readuntil(b"\r\n\r\n")
+        statusLine, _, head = head.partition(b"\r\n")
+        version, status, reason = (statusLine.decode("latin-1").split(" ", 2) + [""])[:3]
+        if not version.startswith("HTTP/"):
+            raise http.client.BadStatusLine(statusLine)
+        status = int(status)
+        responseHeaders = http.client.parse_headers(io.BytesIO(head))
+        
+        connection = (responseHeaders.get("connection") or "").lower()
+        keepAlive = connection != "close" if version != "HTTP/1.0" else connection == "keep-alive"
+        if method == "HEAD" or status in (204, 304) or 100 <= status < 200:
+            data = b""
+        elif "chunked" in (responseHeaders.get("transfer-encoding") or "").lower():
+            chunks = []
+            while True:
+                size = await reader.readuntil(b"\r\n")
+                size = int(size.split(b";", 1)[0].strip(), 16)
+                if size == 0:
+                    #Skip any trailers
+                    while await reader.readuntil(b"\r\n") != b"\r\n":
+                        pass
+                    break
+                chunks.append(await reader.readexactly(size))
+                await reader.readexactly(2)
+            data = b"".join(chunks)
+        elif responseHeaders.get("content-length") != None:
+            data = await reader.readexactly(int(responseHeaders["content-length"]))
+        else:
+            data = await reader.read()
+            keepAlive = False
+        self.lastUsed = time.monotonic()
+        return status, reason.strip(), responseHeaders, data, keepAlive
+
+class AsyncConnectionPool:
+    """The asyncio counterpart of ConnectionPool. Keeps connections open per
+        host and limits each host to maxSize open connections, further
+        requests wait for one to free up. This lets thousands of requests be
+        in flight on one event loop without opening thousands of sockets.
+        Unlike ConnectionPool, response bodies are always read in full.
+    """
+    def __init__(self, maxSize = 100, idleTimeout = 30, timeout = 30, context = None):
+        self.maxSize = maxSize
+        self.idleTimeout = idleTimeout
+        self.timeout = timeout
+        self.context = context or ssl.create_default_context()
+        #(scheme, host, port): [AsyncConnection, ...]
+        self.idle = {}
+        #(scheme, host, port): asyncio.Semaphore
+        self.limits = {}
+    
+    async def connect(self, key):
+        scheme, host, port = key
+        if scheme == "https":
+            connecting = asyncio.open_connection(host, port,
+                ssl = self.context, server_hostname = host)
+        else:
+            connecting = asyncio.open_connection(host, port)
+        reader, writer = await asyncio.wait_for(connecting, self.timeout)
+        return AsyncConnection(reader, writer)
+    
+    async def acquire(self, key):
+        """Returns (connection, reused) for key."""
+        idle = self.idle.get(key)
+        now = time.monotonic()
+        while idle:
+            connection = idle.pop()
+            if now - connection.lastUsed < self.idleTimeout and not connection.reader.at_eof():
+                return connection, True
+            connection.close()
+        return await self.connect(key), False
+    
+    def release(self, key, connection):
+        self.idle.setdefault(key, []).append(connection)
+    
+    async def request(self, method, url, headers = None, body = None):
+        """Send a request and return an AsyncResponse. HTTP error statuses
+            are returned, not raised. Connection failures raise
+            urllib.error.URLError, and so do connects and requests that take
+            longer than timeout seconds.
+        """
+        parts = urllib.parse.urlsplit(url)
+        scheme = parts.scheme.lower()
+        if scheme not in ("http", "https"):
+            raise urllib.error.URLError("Unsupported scheme {}".format(scheme))
+        port = parts.port or (443 if scheme == "https" else 80)
+        key = (scheme, parts.hostname, port)
+        host = parts.netloc.rpartition("@")[2]
+        selector = parts.path or "/"
+        if parts.query:
+            selector += "?" + parts.query
+        
+        limit = self.limits.get(key)
+        if limit == None:
+            limit = self.limits[key] = asyncio.Semaphore(self.maxSize)
+        async with limit:
+            while True:
+                connection = reused = None
+                try:
+                    connection, reused = await self.acquire(key)
+                    status, reason, responseHeaders, data, keepAlive = await asyncio.wait_for(
+                        connection.request(method, host, selector, headers or {}, body),
+                        self.timeout)
+                except (asyncio.IncompleteReadError, ConnectionResetError,
+                        BrokenPipeError) as e:
+                    #The server may have closed a kept alive connection, retry
+                    #idempotent requests once on a new connection
+                    if connection:
+                        connection.close()
+                    if reused and method in IDEMPOTENT_METHODS:
+                        continue
+                    raise urllib.error.URLError(e)
+                except (OSError, asyncio.TimeoutError, asyncio.LimitOverrunError,
+                        http.client.HTTPException, ValueError) as e:
+                    if connection:
+                        connection.close()
+                    raise urllib.error.URLError(e)
+                except BaseException:
+                    if connection:
+                        connection.close()
+                    raise
+                if keepAlive:
+                    self.release(key, connection)
+                else:
+                    connection.close()
+                return AsyncResponse(url, status, reason, responseHeaders, data)
+    
+    async def close(self):
+        """Close every idle connection."""
+        idle = self.idle
+        self.idle = {}
+        for connections in idle.values():
+            for connection in connections:
+                connection.close()
@@ -23,12 +23,27 @@ freely, subject to the following restrictions:
 """
 
 import uuid
+import collections
+import collections.abc
+import concurrent.futures
+import itertools
+import os
 import datetime
 import base64
-import io
+import array
 import struct
+import re
+import sys
 import xml.etree.ElementTree as ET
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+#Typed arrays are encoded as LLSD arrays of their values
+typedArrayTypes = (array.array, numpy.ndarray) if numpy else (array.array,)
+
 class URI(str):
     def __repr__(self):
         return "URI({})".format(super().__repr__())
@@ -36,7 +51,7 @@ class URI(str):
 #Encoders
 def llsdEncodeXml(input, destination, *args, optimize = False, encoding = "base64", **kwargs):
     t = type(input)
-    if input == None:
+    if input is None:
         elm = ET.SubElement(destination, "undef")
     elif t == bool:
         elm = ET.SubElement(destination, "boolean")
@@ -72,6 +87,8 @@ def llsdEncodeXml(input, destination, *args, optimize = False, encoding = "base6
                 elm.text = base64.b16encode(input).decode()
             else:
                 raise ValueError("Unknown binary encoding {}!".format(encoder))
+        if encoder != "base64":
+            elm.set("encoding", encoder)
     elif t == datetime.datetime:
         elm = ET.SubElement(destination, "date")
         elm.text = input.strftime("%Y-%m-%dT%H:%M:%S.%fZ")
@@ -91,17 +108,395 @@ def llsdEncodeXml(input, destination, *args, optimize = False, encoding = "base6
         root = ET.SubElement(destination, "array")
         for value in input:
             llsdEncodeXml(value, root, *args, **kwargs)
+    elif t in typedArrayTypes:
+        llsdEncodeXml(input.tolist(), destination, *args, **kwargs)
+
+XML_HEADER = b"<?xml version='1.0' encoding='UTF-8'?>\n"
+
+def escapeXml(input):
+    """Escape text for an XML element and encode it the way ElementTree
+        would.
+    """
+    if "&" in input:
+        input = input.replace("&", "&amp;")
+    if "<" in input:
+        input = input.replace("<", "&lt;")
+    if ">" in input:
+        input = input.replace(">", "&gt;")
+    return input.encode("utf-8", "xmlcharrefreplace")
+
+#Writers used by llsdWriteXml, these append straight to a bytearray.
+#Nested values are never optimized, the same as llsdEncodeXml.
+def writeXmlUndef(input, destination, optimize, encoding):
+    destination += b"<undef />"
+
+def writeXmlBoolean(input, destination, optimize, encoding):
+    if input:
+        destination += b"<boolean>true</boolean>"
+    elif optimize:
+        destination += b"<boolean />"
+    else:
+        destination += b"<boolean>false</boolean>"
+
+def writeXmlInteger(input, destination, optimize, encoding):
+    if input != 0 or not optimize:
+        destination += b"<integer>%d</integer>" % input
+    else:
+        destination += b"<integer />"
+
+def writeXmlReal(input, destination, optimize, encoding):
+    if input != 0 or not optimize:
+        destination += b"<real>"
+        destination += str(input).encode()
+        destination += b"</real>"
+    else:
+        destination += b"<real />"
+
+def writeXmlUUID(input, destination, optimize, encoding):
+    if input.int != 0 or not optimize:
+        destination += b"<uuid>"
+        destination += str(input).encode()
+        destination += b"</uuid>"
+    else:
+        destination += b"<uuid />"
+
+def writeXmlString(input, destination, optimize, encoding):
+    if input != "":
+        destination += b"<string>"
+        destination += escapeXml(input)
+        destination += b"</string>"
+    else:
+        destination += b"<string />"
+
+def writeXmlBinary(input, destination, optimize, encoding):
+    if encoding == "base64":
+        destination += b"<binary"
+        text = base64.b64encode(input)
+    elif encoding == "base85":
+        destination += b'<binary encoding="base85"'
+        #The base85 alphabet has <, > and &
+        text = escapeXml(base64.b85encode(input).decode())
+    elif encoding == "base16":
+        destination += b'<binary encoding="base16"'
+        text = base64.b16encode(input)
+    else:
+        raise ValueError("Unknown binary encoding {}!".format(encoding))
+    if text:
+        destination += b">"
+        destination += text
+        destination += b"</binary>"
+    else:
+        destination += b" />"
+
+def writeXmlDate(input, destination, optimize, encoding):
+    destination += b"<date>"
+    destination += input.strftime("%Y-%m-%dT%H:%M:%S.%fZ").encode()
+    destination += b"</date>"
+
+def writeXmlURI(input, destination, optimize, encoding):
+    if input != "":
+        destination += b"<uri>"
+        destination += escapeXml(input)
+        destination += b"</uri>"
+    else:
+        destination += b"<uri />"
+
+def writeXmlMap(input, destination, optimize, encoding):
+    if not input:
+        destination += b"<map />"
+        return
+    destination += b"<map>"
+    for key, value in input.items():
+        if type(key) != str:
+            raise ValueError("Dictionary keys must be type str, not {}!".format(type(key)))
+        if key:
+            destination += b"<key>"
+            destination += escapeXml(key)
+            destination += b"</key>"
+        else:
+            destination += b"<key />"
+        writer = xmlWriters.get(type(value))
+        if not writer:
+            raise ValueError("Cannot encode {} as LLSD!".format(type(value)))
+        writer(value, destination, False, "base64")
+    destination += b"</map>"
+
+def writeXmlArray(input, destination, optimize, encoding):
+    if not input:
+        destination += b"<array />"
+        return
+    destination += b"<array>"
+    for value in input:
+        writer = xmlWriters.get(type(value))
+        if not writer:
+            raise ValueError("Cannot encode {} as LLSD!".format(type(value)))
+        writer(value, destination, False, "base64")
+    destination += b"</array>"
+
+def writeXmlTypedArray(input, destination, optimize, encoding):
+    writeXmlArray(input.tolist(), destination, optimize, encoding)
+
+xmlWriters = {
+    type(None): writeXmlUndef,
+    bool: writeXmlBoolean,
+    int: writeXmlInteger,
+    float: writeXmlReal,
+    uuid.UUID: writeXmlUUID,
+    str: writeXmlString,
+    bytes: writeXmlBinary,
+    datetime.datetime: writeXmlDate,
+    URI: writeXmlURI,
+    dict: writeXmlMap,
+    list: writeXmlArray,
+}
+for t in typedArrayTypes:
+    xmlWriters[t] = writeXmlTypedArray
+
+def llsdWriteXml(input, destination, optimize = True, encoding = "base64"):
+    """Encode input as a LLSD+XML document straight into the bytearray
+        destination, without building an ElementTree.
+        The output is identical to llsdEncode(input, format = "xml").
+    """
+    writer = xmlWriters.get(type(input))
+    if not writer:
+        raise ValueError("Cannot encode {} as LLSD!".format(type(input)))
+    destination += XML_HEADER
+    destination += b"<llsd>"
+    writer(input, destination, optimize, encoding)
+    destination += b"</llsd>"
+
+class Template:
+    """A LLSD+XML map with a fixed set of keys, compiled ahead of time.
+        The header, keys and closing tags are encoded once, so encoding only
+        has to write the values. The output is identical to llsdEncode() of
+        a dictionary with the same keys in the same order.
+    """
+    __slots__ = ("keys", "parts", "suffix")
+    
+    def __init__(self, keys):
+        self.keys = tuple(keys)
+        parts = []
+        prefix = XML_HEADER + b"<llsd><map>"
+        for key in self.keys:
+            if type(key) != str:
+                raise ValueError("Dictionary keys must be type str, not {}!".format(type(key)))
+            if key:
+                parts.append(prefix + b"<key>" + escapeXml(key) + b"</key>")
+            else:
+                parts.append(prefix + b"<key />")
+            prefix = b""
+        if parts:
+            self.suffix = b"</map></llsd>"
+        else:
+            #llsdEncode writes an empty map as <map />
+            parts.append(XML_HEADER + b"<llsd><map />")
+            self.suffix = b"</llsd>"
+        self.parts = tuple(parts)
+    
+    def encode(self, *values):
+        """Encode values, given in the same order as the template keys."""
+        if len(values) != len(self.keys):
+            raise ValueError("Template expects {} values, got {}!".format(len(self.keys), len(values)))
+        result = bytearray()
+        writers = xmlWriters
+        for part, value in zip(self.parts, values):
+            result += part
+            writer = writers.get(type(value))
+            if not writer:
+                raise ValueError("Cannot encode {} as LLSD!".format(type(value)))
+            writer(value, result, False, "base64")
+        if not values:
+            result += self.parts[0]
+        result += self.suffix
+        return bytes(result)
+    
+    def encodeDict(self, input):
+        """Encode the values of the dictionary input for the template keys."""
+        return self.encode(*[input[key] for key in self.keys])
+
+def compileTemplate(keys):
+    """Compile a Template for maps with the given keys."""
+    return Template(keys)
+
+BINARY_HEADER = b"<?llsd/binary?>\n"
+EPOCH = datetime.datetime(1970, 1, 1)
+
+packInt = struct.Struct(">i").pack
+packReal = struct.Struct(">d").pack
+packDate = struct.Struct("<d").pack
+packLength = struct.Struct(">I").pack
+
+def dateToSeconds(input):
+    """Convert a datetime to seconds since the epoch. Naive datetimes are
+        treated as UTC, the same as the LLSD+XML encoder does.
+    """
+    if input.tzinfo:
+        return input.timestamp()
+    return (input - EPOCH).total_seconds()
+
+def llsdEncodeBinary(input, destination):
+    """Encode input in LLSD binary format, appending it to the bytearray
+        destination.
+    """
+    t = type(input)
+    if input is None:
+        destination += b"!"
+    elif t == bool:
+        destination += b"1" if input else b"0"
+    elif t == int:
+        if input < -0x80000000 or input > 0x7FFFFFFF:
+            raise ValueError("Integer {} does not fit in 32 bits!".format(input))
+        destination += b"i"
+        destination += packInt(input)
+    elif t == float:
+        destination += b"r"
+        destination += packReal(input)
+    elif t == uuid.UUID:
+        destination += b"u"
+        destination += input.bytes
+    elif t == str:
+        input = input.encode()
+        destination += b"s"
+        destination += packLength(len(input))
+        destination += input
+    elif t == bytes:
+        destination += b"b"
+        destination += packLength(len(input))
+        destination += input
+    elif t == datetime.datetime:
+        destination += b"d"
+        destination += packDate(dateToSeconds(input))
+    elif t == URI:
+        input = input.encode()
+        destination += b"l"
+        destination += packLength(len(input))
+        destination += input
+    elif t == dict:
+        destination += b"{"
+        destination += packLength(len(input))
+        for key in input:
+            if type(key) != str:
+                raise ValueError("Dictionary keys must be type str, not {}!".format(type(key)))
+            encoded = key.encode()
+            destination += b"k"
+            destination += packLength(len(encoded))
+            destination += encoded
+            llsdEncodeBinary(input[key], destination)
+        destination += b"}"
+    elif t == list:
+        destination += b"["
+        destination += packLength(len(input))
+        for value in input:
+            llsdEncodeBinary(value, destination)
+        destination += b"]"
+    elif t in typedArrayTypes:
+        llsdEncodeBinary(input.tolist(), destination)
+    else:
+        raise ValueError("Cannot encode {} as LLSD!".format(t))
+
+NOTATION_HEADER = b"<?llsd/notation?>\n"
 
-def llsdEncode(input, *args, format = "xml", **kwargs):
+def escapeNotation(input, quote = b"'"):
+    """Escape a string for use inside a quoted LLSD notation string."""
+    input = input.encode()
+    if b"\\" in input:
+        input = input.replace(b"\\", b"\\\\")
+    if quote in input:
+        input = input.replace(quote, b"\\" + quote)
+    return input
+
+def llsdEncodeNotation(input, destination, encoding = "base64"):
+    """Encode input in LLSD notation format, appending it to the bytearray
+        destination.
+    """
+    t = type(input)
+    if input is None:
+        destination += b"!"
+    elif t == bool:
+        destination += b"1" if input else b"0"
+    elif t == int:
+        destination += b"i%d" % input
+    elif t == float:
+        destination += b"r"
+        destination += repr(input).encode()
+    elif t == uuid.UUID:
+        destination += b"u"
+        destination += str(input).encode()
+    elif t == str:
+        destination += b"'"
+        destination += escapeNotation(input)
+        destination += b"'"
+    elif t == bytes:
+        if encoding == "base64":
+            destination += b'b64"'
+            destination += base64.b64encode(input)
+        elif encoding == "base85":
+            destination += b'b85"'
+            destination += base64.b85encode(input)
+        elif encoding == "base16":
+            destination += b'b16"'
+            destination += base64.b16encode(input)
+        else:
+            raise ValueError("Unknown binary encoding {}!".format(encoding))
+        destination += b'"'
+    elif t == datetime.datetime:
+        destination += b'd"'
+        destination += input.strftime("%Y-%m-%dT%H:%M:%S.%fZ").encode()
+        destination += b'"'
+    elif t == URI:
+        destination += b'l"'
+        destination += escapeNotation(input, b'"')
+        destination += b'"'
+    elif t == dict:
+        destination += b"{"
+        first = True
+        for key in input:
+            if type(key) != str:
+                raise ValueError("Dictionary keys must be type str, not {}!".format(type(key)))
+            if not first:
+                destination += b","
+            first = False
+            destination += b"'"
+            destination += escapeNotation(key)
+            destination += b"':"
+            llsdEncodeNotation(input[key], destination, encoding)
+        destination += b"}"
+    elif t == list:
+        destination += b"["
+        first = True
+        for value in input:
+            if not first:
+                destination += b","
+            first = False
+            llsdEncodeNotation(value, destination, encoding)
+        destination += b"]"
+    elif t in typedArrayTypes:
+        llsdEncodeNotation(input.tolist(), destination, encoding)
+    else:
+        raise ValueError("Cannot encode {} as LLSD!".format(t))
+
+def llsdEncode(input, *args, format = "xml", header = True, **kwargs):
     if format == "xml":
-        root = ET.Element("llsd")
-        if "optimize" not in kwargs:
-            kwargs["optimize"] = True
-        llsdEncodeXml(input, root, *args, **kwargs)
-        xml = ET.ElementTree(root)
-        f = io.BytesIO()
-        xml.write(f, encoding='UTF-8', xml_declaration=True)
-        return f.getvalue()
+        result = bytearray()
+        llsdWriteXml(input, result, kwargs.get("optimize", True),
+            kwargs.get("encoding", "base64"))
+        return bytes(result)
+    elif format == "binary":
+        result = bytearray(BINARY_HEADER if header else b"")
+        llsdEncodeBinary(input, result)
+        return bytes(result)
+    elif format == "notation":
+        result = bytearray(NOTATION_HEADER if header else b"")
+        llsdEncodeNotation(input, result, kwargs.get("encoding", "base64"))
+        return bytes(result)
+    else:
+        raise ValueError("Unknown serialization format {}!".format(format))
+
+def dump(input, output, *args, format = "xml", **kwargs):
+    """Encode input and write it to the file object output, such as a
+        socket or request body. The counterpart of load().
+    """
+    output.write(llsdEncode(input, *args, format = format, **kwargs))
 
 #Decoders
 def parseISODate(input):
@@ -113,127 +508,858 @@ def parseISODate(input):
         hour, minute, second = time.split(":", 3)
         if "." in second:
             second, microsecond = second.split(".", 2)
+            microsecond = microsecond[:6].ljust(6, "0")
         else:
             microsecond = 0
         return datetime.datetime(*[int(i) for i in [year, month, day, hour, minute, second, microsecond]])
     except ValueError:
         raise ValueError("Invalid timestamp '{}'!".format(input))
 
-def llsdDecodeXml(input):
-    if input.tag == "undef":
+XML_MAX_DEPTH = 256
+
+#Decoders for scalar LLSD+XML elements, called with the element text and
+#attributes. Missing text is passed as "".
+def decodeXmlUndef(text, attrib):
+    return None
+
+def decodeXmlBoolean(text, attrib):
+    value = text.lower()
+    if value == "1" or value == "true":
+        return True
+    elif value == "" or value == "0" or value == "false":
+        return False
+    raise ValueError("Unexpected value '{}' for boolean!".format(value))
+
+def decodeXmlInteger(text, attrib):
+    if not text:
+        return 0
+    return int(text)
+
+def decodeXmlReal(text, attrib):
+    if not text:
+        return 0.0
+    return float(text)
+
+def decodeXmlUUID(text, attrib):
+    if not text:
+        return uuid.UUID(int = 0)
+    return uuid.UUID(text)
+
+def decodeXmlString(text, attrib):
+    return text
+
+def decodeXmlBinary(text, attrib):
+    encoding = attrib.get("encoding", "base64").lower()
+    if encoding == "base64":
+        return base64.b64decode(text)
+    elif encoding == "base85":
+        return base64.b85decode(text)
+    elif encoding == "base16":
+        return base64.b16decode(text)
+    raise ValueError("Unknown encoding {} for binary element!".format(encoding))
+
+def decodeXmlDate(text, attrib):
+    if not text:
+        return EPOCH
+    return parseISODate(text)
+
+def decodeXmlURI(text, attrib):
+    return URI(text)
+
+xmlDecoders = {
+    "undef": decodeXmlUndef,
+    "boolean": decodeXmlBoolean,
+    "integer": decodeXmlInteger,
+    "real": decodeXmlReal,
+    "uuid": decodeXmlUUID,
+    "string": decodeXmlString,
+    "binary": decodeXmlBinary,
+    "date": decodeXmlDate,
+    "uri": decodeXmlURI,
+}
+
+def typedArray(tag, values, kind = True):
+    """Convert the texts or numbers in values to a typed array. tag is
+        "integer" or "real". kind is "numpy" or "array" to pick the array
+        type, or True for NumPy when it is installed and array.array when it
+        is not. Integers are 32 bit, or 64 bit if any of them does not fit.
+    """
+    if kind == True:
+        kind = "numpy" if numpy else "array"
+    if tag == "integer":
+        values = [int(value) for value in values]
+        #Out of range for LLSD, but the decoder accepts it elsewhere
+        wide = values and (min(values) < -0x80000000 or max(values) > 0x7fffffff)
+        if kind == "numpy":
+            return numpy.array(values, numpy.int64 if wide else numpy.int32)
+        return array.array("q" if wide else "i", values)
+    if kind == "numpy":
+        return numpy.fromiter(map(float, values), numpy.float64, len(values))
+    return array.array("d", map(float, values))
+
+def xmlTypedArray(input, kind):
+    """Returns a typed array for an <array> element whose children are all
+        <integer> or all <real>, otherwise None.
+    """
+    tag = input[0].tag
+    if tag != "integer" and tag != "real":
         return None
-    elif input.tag == "boolean":
-        value = input.text
-        if value == None:
-            return False
-        value = value.lower()
-        if value in ["1", "true"]:
-            return True
-        elif value in ["", "0", "false"]:
-            return False
-        else:
-            raise ValueError("Unexpected value '{}' for boolean!".format(value))
-    elif input.tag == "integer":
-        if input.text == None:
-            return 0
-        return int(input.text)
-    elif input.tag == "real":
-        if input.text == None:
-            return 0
-        return float(input.text)
-    elif input.tag == "uuid":
-        if input.text == None:
-            return uuid.UUID(bytes=b"\0\0\0\0\0\0\0\0\0\0\0\0\0\0\0\0")
-        return uuid.UUID(input.text)
-    elif input.tag == "string":
-        if input.text == None:
-            return ""
-        return input.text
-    elif input.tag == "binary":
-        if input.text == None:
-            return b""
-        encoding = input.attrib.get("encoding", "base64").lower()
-        if encoding == "base64":
-            return base64.b64decode(input.text)
-        elif encoding == "base85":
-            return base64.b85decode(input.text)
-        elif encoding == "base16":
-            return base64.b16decode(input.text)
+    for elm in input:
+        if elm.tag != tag:
+            return None
+    return typedArray(tag, [elm.text or "0" for elm in input], kind)
+
+def llsdDecodeXml(input, maxDepth = XML_MAX_DEPTH, maxNodes = None,
+                    typedArrays = False):
+    """Decode a LLSD value from an ElementTree element.
+        Maps and arrays are walked with an explicit stack, so nesting does not
+        recurse. maxDepth limits how deeply maps and arrays may nest and
+        maxNodes limits the total number of elements below <llsd>, None
+        disables either limit. Map keys are interned, so repeated keys share one string.
+        If typedArrays is set, arrays holding only integers or only reals are
+        converted in bulk to typed arrays, see typedArray().
+    """
+    decoders = xmlDecoders
+    intern = sys.intern
+    nodes = 1
+    result = {}
+    #Each entry is (container, iterator over the children, is map). Map
+    #children are iterated as (key, value) pairs.
+    stack = [(result, iter(((None, input),)), True)]
+    while stack:
+        container, children, isMap = stack[-1]
+        for item in children:
+            if isMap:
+                key, elm = item
+            else:
+                elm = item
+            tag = elm.tag
+            decoder = decoders.get(tag)
+            pairs = None
+            if decoder:
+                value = decoder(elm.text or "", elm.attrib)
+            elif tag == "map" or tag == "array":
+                if maxDepth != None and len(stack) > maxDepth:
+                    raise ValueError("LLSD+XML is nested deeper than {}!".format(maxDepth))
+                count = len(elm)
+                nodes += count
+                if maxNodes != None and nodes > maxNodes:
+                    raise ValueError("LLSD+XML has more than {} elements!".format(maxNodes))
+                if tag == "map":
+                    if count % 2:
+                        raise ValueError("Unexpected odd number of elements in map!")
+                    value = {}
+                    pairs = iter(elm)
+                    pairs = zip(pairs, pairs)
+                else:
+                    value = None
+                    if typedArrays and count:
+                        value = xmlTypedArray(elm, typedArrays)
+                    if value is None:
+                        value = []
+                        pairs = iter(elm)
+            else:
+                raise ValueError("Unexpected {} element in LLSD!".format(tag))
+            
+            if isMap:
+                if key == None:
+                    result = value
+                elif key.tag != "key":
+                    raise ValueError("Unexpected {} element in map, expected key!".format(key.tag))
+                else:
+                    container[intern(key.text or "")] = value
+            else:
+                container.append(value)
+            if pairs != None:
+                stack.append((value, pairs, tag == "map"))
+                break
         else:
-            raise ValueError("Unknown encoding {} for binary element!".format(encoding))
-    elif input.tag == "date":
-        if input.text == None:
-            return datetime.datetime.fromtimestamp(0)
-        return parseISODate(input.text)
-    elif input.tag == "uri":
-        if input.text == None:
-            return URI("")
-        return URI(input.text)
-    elif input.tag == "map":
-        result = {}
-        for i in range(0, len(input), 2):
-            if input[i].tag != "key":
-                raise ValueError("Unexpected {} element in map, expected key!".format(input[i].tag))
-            result[input[i].text] = llsdDecodeXml(input[i+1])
-        return result
-    elif input.tag == "array":
-        result = [None]*len(input)
-        for i in range(0, len(input)):
-            result[i] = llsdDecodeXml(input[i])
-        return result
-    else:
-        raise ValueError("Unexpected {} element in LLSD!".format(input.tag))
+            stack.pop()
+    return result
+
+def llsdDecodeXmlLazy(input):
+    """Wrap an ElementTree element in a lazy view. Maps and arrays become
+        LazyMap and LazyArray, scalars are decoded immediately.
+    """
+    tag = input.tag
+    if tag == "map":
+        return LazyMap(input)
+    elif tag == "array":
+        return LazyArray(input)
+    decoder = xmlDecoders.get(tag)
+    if not decoder:
+        raise ValueError("Unexpected {} element in LLSD!".format(tag))
+    return decoder(input.text or "", input.attrib)
+
+class LazyMap(collections.abc.Mapping):
+    """Read only view of a LLSD+XML map. Values are decoded on first access
+        and remembered. Use dict(view) for a plain, still lazy at deeper
+        levels, dictionary.
+    """
+    __slots__ = ("element", "index", "decoded")
     
-def llsdDecode(input, *args, format = None, maxHeaderLength = 128, **kwargs):
-    if format == None:
-        isBytes = type(input) == bytes
-        i = 0
-        l = len(input)
-        while i < l and i < maxHeaderLength:
-            if isBytes:
-                c = chr(input[i])
+    def __init__(self, element):
+        self.element = element
+        self.index = None
+        self.decoded = {}
+    
+    def getIndex(self):
+        if self.index == None:
+            element = self.element
+            if len(element) % 2:
+                raise ValueError("Unexpected odd number of elements in map!")
+            intern = sys.intern
+            index = {}
+            for i in range(0, len(element), 2):
+                key = element[i]
+                if key.tag != "key":
+                    raise ValueError("Unexpected {} element in map, expected key!".format(key.tag))
+                index[intern(key.text or "")] = element[i+1]
+            self.index = index
+        return self.index
+    
+    def __getitem__(self, key):
+        try:
+            return self.decoded[key]
+        except KeyError:
+            pass
+        value = llsdDecodeXmlLazy(self.getIndex()[key])
+        self.decoded[key] = value
+        return value
+    
+    def __contains__(self, key):
+        return key in self.getIndex()
+    
+    def __iter__(self):
+        return iter(self.getIndex())
+    
+    def __len__(self):
+        return len(self.element) // 2
+    
+    def __repr__(self):
+        return "LazyMap({})".format(dict(self))
+
+#Placeholder for LazyArray values that have not been decoded yet
+notDecoded = object()
+
+class LazyArray(collections.abc.Sequence):
+    """Read only view of a LLSD+XML array. Values are decoded on first access
+        and remembered.
+    """
+    __slots__ = ("element", "decoded")
+    
+    def __init__(self, element):
+        self.element = element
+        self.decoded = [notDecoded] * len(element)
+    
+    def __getitem__(self, index):
+        if type(index) == slice:
+            return [self[i] for i in range(*index.indices(len(self.decoded)))]
+        value = self.decoded[index]
+        if value is notDecoded:
+            value = llsdDecodeXmlLazy(self.element[index])
+            self.decoded[index] = value
+        return value
+    
+    def __len__(self):
+        return len(self.decoded)
+    
+    def __eq__(self, other):
+        if not isinstance(other, collections.abc.Sequence) or isinstance(other, (str, bytes)):
+            return NotImplemented
+        return len(self) == len(other) and all(a == b for a, b in zip(self, other))
+    
+    def __repr__(self):
+        return "LazyArray({})".format(list(self))
+
+unpackInt = struct.Struct(">i").unpack_from
+unpackReal = struct.Struct(">d").unpack_from
+unpackDate = struct.Struct("<d").unpack_from
+unpackLength = struct.Struct(">I").unpack_from
+
+def llsdDecodeBinaryScalar(input, c, offset):
+    """Decode a LLSD binary value that is not a map or array. c is its type
+        byte, offset is just after it. Returns (value, offset after the
+        value).
+    """
+    if c == 0x21: # !
+        return None, offset
+    elif c == 0x31: # 1
+        return True, offset
+    elif c == 0x30: # 0
+        return False, offset
+    elif c == 0x69: # i
+        return unpackInt(input, offset)[0], offset + 4
+    elif c == 0x72: # r
+        return unpackReal(input, offset)[0], offset + 8
+    elif c == 0x75: # u
+        end = offset + 16
+        if end > len(input):
+            raise ValueError("Truncated UUID in LLSD binary!")
+        return uuid.UUID(bytes=bytes(input[offset:end])), end
+    elif c == 0x73 or c == 0x6C or c == 0x62: # s, l, b
+        length, = unpackLength(input, offset)
+        offset += 4
+        end = offset + length
+        if end > len(input):
+            raise ValueError("Truncated value in LLSD binary!")
+        if c == 0x73:
+            return str(input[offset:end], "utf-8"), end
+        elif c == 0x6C:
+            return URI(str(input[offset:end], "utf-8")), end
+        return bytes(input[offset:end]), end
+    elif c == 0x64: # d
+        seconds, = unpackDate(input, offset)
+        try:
+            return EPOCH + datetime.timedelta(seconds = seconds), offset + 8
+        except (OverflowError, ValueError):
+            #Out of range for datetime, infinite or NaN
+            raise ValueError("Invalid date in LLSD binary!")
+    raise ValueError("Unexpected {!r} in LLSD binary!".format(chr(c)))
+
+def llsdDecodeBinaryValue(input, offset, maxDepth = XML_MAX_DEPTH):
+    """Decode a single LLSD binary value from input starting at offset.
+        input may be bytes, bytearray or a memoryview.
+        Maps and arrays are walked with an explicit stack, maxDepth limits
+        how deeply they may nest, None for no limit.
+        Returns (value, offset after the value).
+    """
+    #Each entry is [container, values left to decode]
+    stack = []
+    try:
+        while True:
+            if stack:
+                container = stack[-1][0]
+                if type(container) == dict:
+                    if input[offset] not in (0x6B, 0x73): # k, s
+                        raise ValueError("Unexpected {!r} in LLSD binary map, expected key!".format(chr(input[offset])))
+                    length, = unpackLength(input, offset + 1)
+                    offset += 5
+                    end = offset + length
+                    key = str(input[offset:end], "utf-8")
+                    offset = end
+            
+            c = input[offset]
+            offset += 1
+            count = None
+            if c == 0x7B or c == 0x5B: # {, [
+                if maxDepth != None and len(stack) >= maxDepth:
+                    raise ValueError("LLSD binary is nested deeper than {}!".format(maxDepth))
+                count, = unpackLength(input, offset)
+                offset += 4
+                value = {} if c == 0x7B else []
             else:
-                c = input[i]
-            if c == '"' or c == "'":
-                quoteChar = c
-                while i < l and i < maxHeaderLength:
-                    i += 1
-                    if isBytes:
-                        c = chr(input[i])
-                    else:
-                        c = input[i]
-                    if c == quoteChar:
-                        break
-                    elif c == "\\":
-                        #Assuming the file is valid, no unicode should be in the
-                        #header
-                        i += 1
-                i += 1
-            i += 1
-            if c == ">":
-                break
-        header = input[2:i-2].strip().lower()
-        if header == "llsd/notation":
-            format = "notation"
-        elif header == "llsd/binary":
-            format = "binary"
+                value, offset = llsdDecodeBinaryScalar(input, c, offset)
+            
+            if stack:
+                if type(container) == dict:
+                    container[key] = value
+                else:
+                    container.append(value)
+                stack[-1][1] -= 1
+            else:
+                result = value
+            if count != None:
+                stack.append([value, count])
+            
+            while stack and stack[-1][1] == 0:
+                if type(stack.pop()[0]) == dict:
+                    if input[offset] != 0x7D: # }
+                        raise ValueError("Unterminated map in LLSD binary!")
+                elif input[offset] != 0x5D: # ]
+                    raise ValueError("Unterminated array in LLSD binary!")
+                offset += 1
+            if not stack:
+                return result, offset
+    except (IndexError, struct.error):
+        raise ValueError("Truncated LLSD binary!")
+
+def llsdDecodeBinary(input, offset = None, maxDepth = XML_MAX_DEPTH):
+    """Decode LLSD binary starting at offset. If offset is None, an optional
+        <?llsd/binary?> header is skipped. See llsdDecodeBinaryValue() for
+        maxDepth.
+    """
+    if not isinstance(input, memoryview):
+        input = memoryview(input)
+    if offset == None:
+        match = llsdHeader.match(input)
+        offset = match.end() if match else 0
+    return llsdDecodeBinaryValue(input, offset, maxDepth)[0]
+
+notationWhitespace = re.compile(rb"[ \t\r\n,]*")
+notationTrue = re.compile(rb"true|TRUE|t|T")
+notationFalse = re.compile(rb"false|FALSE|f|F")
+notationInteger = re.compile(rb"[-+]?[0-9]+")
+notationReal = re.compile(rb"[-+]?(?:[0-9]+\.?[0-9]*(?:[eE][-+]?[0-9]+)?|\.[0-9]+(?:[eE][-+]?[0-9]+)?|nan|NaN|inf(?:inity)?|Inf(?:inity)?)")
+notationUUID = re.compile(rb"[0-9A-Fa-f]{8}-[0-9A-Fa-f]{4}-[0-9A-Fa-f]{4}-[0-9A-Fa-f]{4}-[0-9A-Fa-f]{12}")
+notationSize = re.compile(rb"\(([0-9]+)\)")
+notationQuoted = {
+    0x27: re.compile(rb"'([^'\\]*(?:\\.[^'\\]*)*)'", re.S),
+    0x22: re.compile(rb'"([^"\\]*(?:\\.[^"\\]*)*)"', re.S),
+}
+notationEscape = re.compile(rb"\\(x[0-9A-Fa-f]{2}|.)", re.S)
+notationEscapes = {
+    b"a": b"\a", b"b": b"\b", b"f": b"\f", b"n": b"\n", b"r": b"\r",
+    b"t": b"\t", b"v": b"\v"
+}
+
+def unescapeNotation(match):
+    c = match.group(1)
+    if len(c) == 3:
+        return bytes((int(c[1:], 16),))
+    return notationEscapes.get(c, c)
+
+def notationError(offset, message):
+    return ValueError("{} at offset {} in LLSD notation!".format(message, offset))
+
+def llsdDecodeNotationString(input, offset):
+    """Decode a quoted or sized notation string starting at offset.
+        Returns (bytes, offset after the string).
+    """
+    c = input[offset]
+    if c == 0x73: # s(size)"raw"
+        match = notationSize.match(input, offset + 1)
+        if not match:
+            raise notationError(offset, "Invalid sized string")
+        return llsdDecodeNotationSized(input, match)
+    pattern = notationQuoted.get(c)
+    match = pattern and pattern.match(input, offset)
+    if not match:
+        raise notationError(offset, "Invalid string")
+    value = match.group(1)
+    if b"\\" in value:
+        value = notationEscape.sub(unescapeNotation, value)
+    return value, match.end()
+
+def llsdDecodeNotationSized(input, match):
+    """Read the raw bytes following a (size) prefix."""
+    offset = match.end()
+    quote = input[offset] if offset < len(input) else None
+    if quote not in (0x27, 0x22):
+        raise notationError(offset, "Expected quote after size")
+    start = offset + 1
+    end = start + int(match.group(1))
+    if end >= len(input) or input[end] != quote:
+        raise notationError(start, "Sized value does not match its length")
+    return bytes(input[start:end]), end + 1
+
+def llsdDecodeNotationScalar(input, offset):
+    """Decode a LLSD notation value that is not a map or array, starting
+        exactly at offset. Returns (value, offset after the value).
+    """
+    c = input[offset]
+    if c == 0x21: # !
+        return None, offset + 1
+    elif c == 0x31: # 1
+        return True, offset + 1
+    elif c == 0x30: # 0
+        return False, offset + 1
+    elif c == 0x74 or c == 0x54: # t, T
+        return True, notationTrue.match(input, offset).end()
+    elif c == 0x66 or c == 0x46: # f, F
+        return False, notationFalse.match(input, offset).end()
+    elif c == 0x69: # i
+        match = notationInteger.match(input, offset + 1)
+        if not match:
+            raise notationError(offset, "Invalid integer")
+        return int(match.group()), match.end()
+    elif c == 0x72: # r
+        match = notationReal.match(input, offset + 1)
+        if not match:
+            raise notationError(offset, "Invalid real")
+        return float(match.group()), match.end()
+    elif c == 0x75: # u
+        match = notationUUID.match(input, offset + 1)
+        if not match:
+            raise notationError(offset, "Invalid UUID")
+        return uuid.UUID(match.group().decode()), match.end()
+    elif c == 0x27 or c == 0x22 or c == 0x73: # ', ", s
+        value, offset = llsdDecodeNotationString(input, offset)
+        return value.decode(), offset
+    elif c == 0x6C: # l
+        value, offset = llsdDecodeNotationString(input, offset + 1)
+        return URI(value.decode()), offset
+    elif c == 0x64: # d
+        value, offset = llsdDecodeNotationString(input, offset + 1)
+        return parseISODate(value.decode()), offset
+    elif c == 0x62: # b
+        match = notationSize.match(input, offset + 1)
+        if match:
+            return llsdDecodeNotationSized(input, match)
+        base = bytes(input[offset+1:offset+3])
+        value, offset = llsdDecodeNotationString(input, offset + 3)
+        if base == b"64":
+            return base64.b64decode(value), offset
+        elif base == b"85":
+            return base64.b85decode(value), offset
+        elif base == b"16":
+            return base64.b16decode(value, casefold = True), offset
+        raise notationError(offset, "Unknown binary encoding")
+    raise notationError(offset, "Unexpected {!r}".format(chr(c)))
+
+def llsdDecodeNotationValue(input, offset, maxDepth = XML_MAX_DEPTH):
+    """Decode a single LLSD notation value from input starting at offset.
+        input must be bytes, bytearray or a memoryview.
+        Maps and arrays are walked with an explicit stack, maxDepth limits
+        how deeply they may nest, None for no limit.
+        Returns (value, offset after the value).
+    """
+    #The maps and arrays being decoded, innermost last
+    stack = []
+    while True:
+        offset = notationWhitespace.match(input, offset).end()
+        if stack:
+            container = stack[-1]
+            isMap = type(container) == dict
+            if offset >= len(input):
+                raise notationError(offset, "Unterminated map" if isMap else "Unterminated array")
+            if input[offset] == (0x7D if isMap else 0x5D): # }, ]
+                stack.pop()
+                offset += 1
+                if not stack:
+                    return container, offset
+                continue
+            if isMap:
+                key, offset = llsdDecodeNotationString(input, offset)
+                offset = notationWhitespace.match(input, offset).end()
+                if offset >= len(input) or input[offset] != 0x3A: # :
+                    raise notationError(offset, "Expected ':' in map")
+                offset = notationWhitespace.match(input, offset + 1).end()
+        
+        if offset >= len(input):
+            raise notationError(offset, "Unexpected end of data")
+        c = input[offset]
+        if c == 0x7B or c == 0x5B: # {, [
+            if maxDepth != None and len(stack) >= maxDepth:
+                raise notationError(offset, "Nested deeper than {}".format(maxDepth))
+            value = {} if c == 0x7B else []
+            offset += 1
         else:
-            tmp = header[0:3]
-            if type(tmp) == bytes:
-                tmp = tmp.decode()
-            if tmp == "xml":
-                format = "xml"
+            value, offset = llsdDecodeNotationScalar(input, offset)
+        
+        if stack:
+            if isMap:
+                container[key.decode()] = value
             else:
-                raise ValueError("Unable to detect serialization format!")
+                container.append(value)
+        if c == 0x7B or c == 0x5B:
+            stack.append(value)
+        elif not stack:
+            return value, offset
+
+def llsdDecodeNotation(input, offset = None, maxDepth = XML_MAX_DEPTH):
+    """Decode LLSD notation starting at offset. If offset is None, an
+        optional <?llsd/notation?> header is skipped. See
+        llsdDecodeNotationValue() for maxDepth.
+    """
+    if type(input) == str:
+        input = input.encode()
+    if offset == None:
+        match = llsdHeader.match(input)
+        offset = match.end() if match else 0
+    return llsdDecodeNotationValue(input, offset, maxDepth)[0]
+
+llsdHeader = re.compile(rb"(?:\xef\xbb\xbf)?[ \t\r\n]*<\?[ \t]*llsd/(binary|notation)[ \t]*\?>\n?", re.I)
+leadingSpace = re.compile(rb"(?:\xef\xbb\xbf)?[ \t\r\n]*")
+notationStart = b"!01tTfFiruslbd'\""
+
+def sniffFormat(input, maxHeaderLength = 128):
+    """Detect the serialization format of a LLSD document.
+        input may be bytes, bytearray, memoryview, str, or a file object with
+        peek(), which is not consumed. Only the first maxHeaderLength bytes
+        are looked at, of a file object only what one peek() returns, which
+        may be less. load() reads the header when it is.
+        Returns (format, offset) where format is "xml", "binary" or
+        "notation" and offset is where the document starts, past any byte
+        order mark, whitespace and <?llsd/...?> header. offset counts bytes,
+        of the UTF-8 encoding for str input.
+    """
+    if hasattr(input, "peek"):
+        input = input.peek(maxHeaderLength)
+    head = input[:maxHeaderLength]
+    if type(head) == str:
+        head = head.encode()
+    elif type(head) != bytes:
+        head = bytes(head)
+    
+    match = llsdHeader.match(head)
+    if match:
+        return match.group(1).lower().decode(), match.end()
+    if head.startswith((b"\xff\xfe", b"\xfe\xff")):
+        #UTF-16, which only XML allows
+        return "xml", 0
+    offset = leadingSpace.match(head).end()
+    c = head[offset:offset+1]
+    if c == b"<":
+        return "xml", offset
+    elif c == b"{" or c == b"[":
+        #Binary maps and arrays start with a big endian length, notation
+        #never has a NUL here
+        if head[offset+1:offset+2] == b"\0":
+            return "binary", offset
+        return "notation", offset
+    elif c and c in notationStart:
+        return "notation", offset
+    raise ValueError("Unable to detect serialization format!")
+
+def detectFormat(input, maxHeaderLength = 128):
+    """Returns the serialization format of input, see sniffFormat()."""
+    return sniffFormat(input, maxHeaderLength)[0]
+
+def llsdDecode(input, *args, format = None, maxHeaderLength = 128,
+                maxDepth = XML_MAX_DEPTH, maxNodes = None, typedArrays = False,
+                lazy = False):
+    """Decode a LLSD document. If format is None it is detected with
+        sniffFormat(). maxDepth applies to every format, maxNodes and
+        typedArrays to LLSD+XML documents, see llsdDecodeXml(). With
+        lazy = True, LLSD+XML maps and arrays are returned as LazyMap and
+        LazyArray views that decode on access. Other formats are always
+        decoded in full.
+    """
+    offset = None
+    if format == None:
+        format, offset = sniffFormat(input, maxHeaderLength)
+    
+    if type(input) == str:
+        if format != "xml":
+            input = input.encode()
+        elif offset:
+            #sniffFormat counts UTF-8 bytes. XML stays a str, so an encoding
+            #declaration in it is ignored.
+            offset = len(input[:offset].encode()[:offset].decode())
     
     if format == "xml":
+        if offset:
+            input = input[offset:] if type(input) == str else memoryview(input)[offset:]
         input = ET.fromstring(input)
         if input.tag != "llsd":
             raise ValueError("Unexpected tag {} in LLSD+XML!".format(input.tag))
-        return llsdDecodeXml(input[0])
+        if not len(input):
+            return None
+        if lazy:
+            return llsdDecodeXmlLazy(input[0])
+        return llsdDecodeXml(input[0], maxDepth, maxNodes, typedArrays)
+    elif format == "binary":
+        return llsdDecodeBinary(input, offset, maxDepth)
+    elif format == "notation":
+        return llsdDecodeNotation(input, offset, maxDepth)
     else:
         raise ValueError("Unknown serialization format {}!".format(format))
-        
+
+def llsdLoadXml(input, chunk = b"", chunkSize = 65536, maxDepth = XML_MAX_DEPTH,
+                maxNodes = None, typedArrays = False):
+    """Incrementally decode LLSD+XML read from the file object input.
+        chunk is data that has already been read from input.
+        Elements are discarded as soon as they have been decoded, so only
+        the decoded result and the currently open maps and arrays are held
+        in memory. maxDepth, maxNodes and typedArrays are the same as for
+        llsdDecodeXml, typed arrays are converted once the array is closed.
+    """
+    decoders = xmlDecoders
+    intern = sys.intern
+    parser = ET.XMLPullParser(("start", "end"))
+    nodes = 0
+    #Each entry is [element, container, pending map key]
+    stack = []
+    result = None
+    started = False
+    while True:
+        if chunk:
+            parser.feed(chunk)
+        else:
+            parser.close()
+        for event, elm in parser.read_events():
+            tag = elm.tag
+            if event == "start":
+                if not started:
+                    if tag != "llsd":
+                        raise ValueError("Unexpected tag {} in LLSD+XML!".format(tag))
+                    started = True
+                    continue
+                #The <llsd> root is not counted, the same as llsdDecodeXml
+                nodes += 1
+                if maxNodes != None and nodes > maxNodes:
+                    raise ValueError("LLSD+XML has more than {} elements!".format(maxNodes))
+                if tag == "map" or tag == "array":
+                    if maxDepth != None and len(stack) >= maxDepth:
+                        raise ValueError("LLSD+XML is nested deeper than {}!".format(maxDepth))
+                    stack.append([elm, {} if tag == "map" else [], None])
+                continue
+            
+            decoder = decoders.get(tag)
+            if decoder:
+                value = decoder(elm.text or "", elm.attrib)
+            elif tag == "map" or tag == "array":
+                if stack[-1][2] != None:
+                    raise ValueError("Unexpected odd number of elements in map!")
+                value = stack.pop()[1]
+                if typedArrays and tag == "array" and value:
+                    t = type(value[0])
+                    if (t == int or t == float) and all(type(i) == t for i in value):
+                        value = typedArray("integer" if t == int else "real",
+                            value, typedArrays)
+            elif tag == "key":
+                if not stack or type(stack[-1][1]) != dict or stack[-1][2] != None:
+                    raise ValueError("Unexpected key element in LLSD+XML!")
+                stack[-1][2] = intern(elm.text or "")
+                del stack[-1][0][-1]
+                continue
+            elif tag == "llsd":
+                continue
+            else:
+                raise ValueError("Unexpected {} element in LLSD!".format(tag))
+            
+            if stack:
+                parent = stack[-1]
+                #Drop the element from the tree now that it has been decoded
+                del parent[0][-1]
+                container = parent[1]
+                if type(container) == dict:
+                    if parent[2] == None:
+                        raise ValueError("Unexpected {} element in map, expected key!".format(tag))
+                    container[parent[2]] = value
+                    parent[2] = None
+                else:
+                    container.append(value)
+            else:
+                elm.clear()
+                result = value
+        if not chunk:
+            break
+        chunk = input.read(chunkSize)
+    if not started:
+        raise ValueError("No LLSD+XML document found!")
+    return result
+
+def readHeader(input, size):
+    """Read size bytes from the file object input, fewer only if it ends
+        first. A single read may return less than asked for."""
+    data = b""
+    while len(data) < size:
+        more = input.read(size - len(data))
+        if not more:
+            break
+        data += more
+    return data
+
+def load(input, *args, format = None, chunkSize = 65536, maxHeaderLength = 128,
+            maxDepth = XML_MAX_DEPTH, maxNodes = None, typedArrays = False,
+            lazy = False):
+    """Decode LLSD from a file object, such as a HTTP response.
+        LLSD+XML is decoded as it is read. Other formats are read in full
+        and decoded in place. The format is detected from the first
+        maxHeaderLength bytes, peeked at if input has peek() and returns
+        them all, read otherwise. The other arguments are the same as for
+        llsdDecode().
+    """
+    chunk = b""
+    offset = None
+    if format == None:
+        #peek() on a HTTP response ignores Content-Length, and would wait
+        #for data that never comes if there is no body
+        head = b""
+        if hasattr(input, "peek") and getattr(input, "length", None) != 0:
+            head = input.peek(maxHeaderLength)[:maxHeaderLength]
+        if len(head) < maxHeaderLength:
+            #No peek, or it may have stopped short of the header, so read
+            #it instead and keep it as the start of the document
+            chunk = readHeader(input, maxHeaderLength)
+            head = chunk
+        format, offset = sniffFormat(head, maxHeaderLength)
+    
+    if format == "xml" and lazy:
+        #Lazy views keep the element tree, so there is nothing to stream
+        data = input.read()
+        if chunk:
+            data = chunk + data
+        return llsdDecode(data[offset:] if offset else data, format = format,
+            maxDepth = maxDepth, lazy = True)
+    elif format == "xml":
+        if not chunk:
+            chunk = input.read(chunkSize)
+        if offset:
+            chunk = chunk[offset:]
+        return llsdLoadXml(input, chunk, chunkSize, maxDepth, maxNodes,
+            typedArrays)
+    
+    data = input.read()
+    if chunk:
+        data = chunk + data
+    if format == "binary":
+        return llsdDecodeBinary(data, offset, maxDepth)
+    elif format == "notation":
+        return llsdDecodeNotation(data, offset, maxDepth)
+    raise ValueError("Unknown serialization format {}!".format(format))
+
+
+def decodeChunk(chunk, kwargs):
+    """Worker for decodeMany, decodes a list of documents."""
+    return [llsdDecode(item, **kwargs) for item in chunk]
+
+def encodeChunk(chunk, kwargs):
+    """Worker for encodeMany, encodes a list of values."""
+    return [llsdEncode(item, **kwargs) for item in chunk]
+
+def mapChunks(function, iterable, workers, chunkSize, kwargs, prepare = None):
+    """Run function over chunks of iterable in a process pool and yield the
+        results in input order. At most two chunks per worker are in flight,
+        so memory stays bounded however long iterable is.
+    """
+    iterator = iter(iterable)
+    if workers == None:
+        workers = os.cpu_count() or 1
+    
+    def nextChunk():
+        chunk = list(itertools.islice(iterator, chunkSize))
+        if prepare:
+            chunk = [prepare(item) for item in chunk]
+        return chunk
+    
+    if workers <= 1:
+        chunk = nextChunk()
+        while chunk:
+            yield from function(chunk, kwargs)
+            chunk = nextChunk()
+        return
+    
+    executor = concurrent.futures.ProcessPoolExecutor(workers)
+    try:
+        pending = collections.deque()
+        exhausted = False
+        while True:
+            while not exhausted and len(pending) < workers * 2:
+                chunk = nextChunk()
+                if chunk:
+                    pending.append(executor.submit(function, chunk, kwargs))
+                else:
+                    exhausted = True
+            if not pending:
+                break
+            yield from pending.popleft().result()
+    finally:
+        executor.shutdown(wait = True, cancel_futures = True)
+
+def asBytes(input):
+    #memoryviews cannot be sent to worker processes
+    if type(input) == memoryview:
+        return input.tobytes()
+    return input
+
+def decodeMany(iterable, workers = None, chunkSize = 64, **kwargs):
+    """Decode many LLSD documents using a pool of worker processes.
+        iterable yields bytes, bytearray, memoryview or str documents.
+        Returns an iterator over the decoded values in input order. workers
+        defaults to the number of CPUs, 1 decodes in this process. kwargs
+        are passed to llsdDecode.
+    """
+    return mapChunks(decodeChunk, iterable, workers, chunkSize, kwargs, asBytes)
+
+def encodeMany(iterable, workers = None, chunkSize = 64, **kwargs):
+    """Encode many values using a pool of worker processes, the counterpart
+        of decodeMany(). kwargs are passed to llsdEncode.
+    """
+    return mapChunks(encodeChunk, iterable, workers, chunkSize, kwargs)
+
 
 if __name__ == "__main__":
     source_test = {
@@ -335,7 +1461,7 @@ if __name__ == "__main__":
     T,
     true,
     TRUE,
-    0
+    0,
     f,
     F,
     false,
@@ -350,17 +1476,18 @@ if __name__ == "__main__":
   [
     r-0.28334,
     r2983287453.3848387
-  ]
+  ],
   'uuid':
   [
     ud7f4aeca-88f1-42a1-b385-b9db18abb255
-  ]
-  'string';
-    'The quick brown fox jumped over the lazy dog.'
+  ],
+  'string':
+  [
+    'The quick brown fox jumped over the lazy dog.',
     "540943c1-7142-4fdd-996f-fc90ed5dd3fa",
     s(10)'0123456789',
     s(10)"0123456789"
-  ]
+  ],
   'binary':
   [
       b64"cmFuZG9t",
@@ -368,11 +1495,11 @@ if __name__ == "__main__":
       b85"YISXJWn>_4c4cxPbZBJ",
       b16'6C617A7920646F67',
       b(10)'0123456789'
-  ]
+  ],
   'date':
   [
     d"2006-02-01T14:29:53.43Z"
-  ]
+  ],
   'uri':
   [
     l"http://sim956.agni.lindenlab.com:12035/runtime/agents"
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+"""
+Name: namecache.py
+Purpose: Short lived in-memory cache of checkName results
+
+Copyright (c) 2021 Kyler Eastridge
+
+This software is provided 'as-is', without any express or implied
+warranty. In no event will the authors be held liable for any damages
+arising from the use of this software.
+
+Permission is granted to anyone to use this software for any purpose,
+including commercial applications, and to alter it and redistribute it
+freely, subject to the following restrictions:
+
+1. The origin of this software must not be misrepresented; you must not
+   claim that you wrote the original software. If you use this software
+   in a product, an acknowledgment in the product documentation would be
+   appreciated but is not required.
+2. Altered source versions must be plainly marked as such, and must not be
+   misrepresented as being the original software.
+3. This notice may not be removed or altered from any source distribution.
+"""
+import hashlib
+import math
+import re
+import threading
+import time
+
+#Matches the names get_error_codes gives errors that mean the username
+#itself is taken or not allowed, as opposed to rate limits, server faults
+#and other errors that may not happen again
+TAKEN_ERRORS = re.compile(r"taken|already|exists|in use|unavailable|"
+    r"not available|not allowed|reserved|banned|profan|too (?:long|short)|"
+    r"invalid.*name|name.*invalid", re.I)
+
+class BloomFilter:
+    """A set that only answers "maybe" or "no", in a fraction of the memory.
+        Sized for capacity keys at errorRate false positives.
+    """
+    def __init__(self, capacity = 100000, errorRate = 0.01):
+        self.capacity = capacity
+        self.size = max(8, int(-capacity * math.log(errorRate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+    
+    def positions(self, key):
+        #Double hashing, two 64 bit halves of one digest give every position
+        digest = hashlib.blake2b(key.encode(), digest_size = 16).digest()
+        a = int.from_bytes(digest[:8], "little")
+        b = int.from_bytes(digest[8:], "little") | 1
+        return ((a + i * b) % self.size for i in range(self.hashes))
+    
+    def add(self, key):
+        bits = self.bits
+        for position in self.positions(key):
+            bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+    
+    def __contains__(self, key):
+        bits = self.bits
+        for position in self.positions(key):
+            if not bits[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+    
+    def __len__(self):
+        return self.count
+
+class NameCache:
+    """Remembers checkName results so repeat checks skip the request.
+        Available names are kept for availableTTL seconds, as someone else may
+        register them at any moment, taken names for takenTTL seconds.
+        A RegAPIError is only remembered if it says the name itself is taken
+        or invalid, that is if its code is in takenCodes or takenErrors, a
+        compiled regular expression, matches its name. Others, such as rate
+        limits and server faults, may not happen again, so the next check
+        asks the server.
+        Names checkName answered False for are also added to a Bloom filter
+        that outlives takenTTL, a hit there answers False without a request.
+        Up to errorRate of free names may be reported taken this way, set
+        bloomCapacity to 0 to disable it. The filter is rebuilt once it
+        holds bloomCapacity names.
+        Pass it to RegAPI(nameCache = ...), it is safe to share between
+        threads and clients.
+    """
+    def __init__(self, takenTTL = 60*60, availableTTL = 10, maxEntries = 10000,
+                    bloomCapacity = 100000, errorRate = 0.01, takenCodes = (),
+                    takenErrors = TAKEN_ERRORS):
+        self.takenTTL = takenTTL
+        self.availableTTL = availableTTL
+        self.maxEntries = maxEntries
+        self.bloomCapacity = bloomCapacity
+        self.errorRate = errorRate
+        self.takenCodes = frozenset(takenCodes)
+        self.takenErrors = takenErrors
+        self.lock = threading.Lock()
+        #key: (expires, result)
+        self.entries = {}
+        self.taken = None
+        if bloomCapacity:
+            self.taken = BloomFilter(bloomCapacity, errorRate)
+    
+    @staticmethod
+    def key(username, lastNameId):
+        #Usernames are not case sensitive
+        return "{}:{}".format(username.lower(), lastNameId)
+    
+    def get(self, username, lastNameId, default = None):
+        """Returns the remembered result for username, True, False or a
+            RegAPIError, or default if there is none."""
+        key = self.key(username, lastNameId)
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry:
+                if entry[0] > now:
+                    return entry[1]
+                del self.entries[key]
+            if self.taken != None and key in self.taken:
+                return False
+        return default
+    
+    def set(self, username, lastNameId, result):
+        """Remember a checkName result, True or the False or RegAPIError given
+            for a taken name. Errors that do not say the name is taken are
+            not remembered."""
+        if result != True and result != False and not self.isTaken(result):
+            return
+        key = self.key(username, lastNameId)
+        now = time.monotonic()
+        ttl = self.availableTTL if result == True else self.takenTTL
+        with self.lock:
+            entries = self.entries
+            entries.pop(key, None)
+            entries[key] = (now + ttl, result)
+            if len(entries) > self.maxEntries:
+                self.prune(now)
+            if result == False and self.taken != None:
+                if len(self.taken) >= self.bloomCapacity:
+                    self.taken = BloomFilter(self.bloomCapacity, self.errorRate)
+                self.taken.add(key)
+    
+    def isTaken(self, error):
+        """Returns True if the RegAPIError error says the name is taken or
+            invalid."""
+        if error.code in self.takenCodes:
+            return True
+        return self.takenErrors != None \
+            and bool(self.takenErrors.search(error.expression or ""))
+    
+    def prune(self, now):
+        #Drop expired entries, then the oldest until there is room
+        entries = self.entries
+        for key in [key for key, entry in entries.items() if entry[0] <= now]:
+            del entries[key]
+        while len(entries) > self.maxEntries:
+            del entries[next(iter(entries))]
+    
+    def invalidate(self, username, lastNameId):
+        """Forget the remembered result for username."""
+        with self.lock:
+            self.entries.pop(self.key(username, lastNameId), None)
+    
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            if self.taken != None:
+                self.taken = BloomFilter(self.bloomCapacity, self.errorRate)
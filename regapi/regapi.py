@@ -22,7 +22,13 @@ freely, subject to the following restrictions:
 3. This notice may not be removed or altered from any source distribution.
 """
 from . import llsd
-import uuid
+from . import httppool
+from .catalog import Catalogs
+from .singleflight import SingleFlight
+import collections
+import re
+import concurrent.futures
+import threading
 import warnings
 import datetime
 import urllib.request
@@ -49,41 +55,81 @@ def parseUsername(input):
         Accepts firstname.lastname, firstname, ("firstname"), etc.
         Returns ("firstname", "lastname")
     """
-    if type(input) == tuple or type(input) == list:
-        if len(input) == 1:
-            return (input[0], "resident")
-        elif len(input) == 2:
-            return tuple(input)
-        else:
-            raise None
-    elif type(input) == str:
+    if type(input) == str:
         if "." in input:
             if " " in input:
                 return None
-            input = input.split(".")
-            if len(input) == 1:
-                return (input[0], "resident")
-            elif len(input) == 2:
-                return tuple(input)
-            else:
+            first, _, last = input.partition(".")
+            if "." in last:
                 return None
         elif " " in input:
-            if "." in input:
-                return None
-            input = input.split(" ")
-            if len(input) == 1:
-                return (input[0], "resident")
-            elif len(input) == 2:
-                return tuple(input)
-            else:
+            first, _, last = input.partition(" ")
+            if " " in last:
                 return None
         else:
             return (input, "resident")
+        return (first, last)
+    elif type(input) == tuple or type(input) == list:
+        if len(input) == 1:
+            return (input[0], "resident")
+        elif len(input) == 2:
+            return tuple(input)
     return None
 
-def doRequest(*args, **kwargs):
+usernamePattern = re.compile(r"[A-Za-z][A-Za-z0-9]{1,30}\Z")
+notUsername = re.compile(r"[^A-Za-z0-9]+")
+
+def isValidUsername(username):
+    """Returns True if username could be registered, 2 to 31 letters and
+        digits starting with a letter. Checked locally, no request is made."""
+    return type(username) == str and usernamePattern.match(username) != None
+
+def generateNameVariants(base, lastNames = None, limit = 50):
+    """Generate up to limit (username, lastNameId) candidates for base, best
+        first. base is anything parseUsername accepts, lastNames is the
+        {id: "name"} catalog from getLastNames. Candidates that are not
+        valid usernames are dropped.
+    """
+    username = parseUsername(base)
+    if username == None:
+        return []
+    first = notUsername.sub("", username[0])
+    last = notUsername.sub("", username[1])
+    resident = RegAPI.LASTNAME_RESIDENT
+    lastNames = lastNames or {}
+    lastNameIds = {name.lower(): id for id, name in lastNames.items()}
+    
+    def candidates():
+        if last.lower() != "resident":
+            if last.lower() in lastNameIds:
+                yield first, lastNameIds[last.lower()]
+            yield first, resident
+            yield first + last, resident
+            yield first + last[:1], resident
+            yield first[:1] + last, resident
+        else:
+            yield first, resident
+        for id in sorted(lastNames):
+            if id != resident:
+                yield first, id
+        for i in range(1, 100):
+            yield "{}{}".format(first, i), resident
+        yield "{}{}".format(first, datetime.date.today().year), resident
+    
+    result = []
+    for candidate in dict.fromkeys(candidates()):
+        if isValidUsername(candidate[0]):
+            result.append(candidate)
+            if len(result) >= limit:
+                break
+    return result
+
+def doRequest(*args, pool = None, **kwargs):
     """Internal function, used to wrap urlopen to accept HTTP errors and not
-        throw them at the window."""
+        throw them at the window. If pool is given, the request is sent over
+        one of its kept alive connections instead."""
+    if pool:
+        return pool.request(*args, **kwargs)
     try:
         return urllib.request.urlopen(*args, **kwargs)
     except urllib.error.HTTPError as e:
@@ -99,6 +145,66 @@ class RegAPIError(BaseException):
         self.message = message
         self.code = code
 
+def createUserData(username, lastNameId = None, estate = None, region = None,
+                    location = None, lookAt = None, marketing = None,
+                    successUrl = None, errorUrl = None, maturity = None):
+    """Internal function, builds the create_user request body. See
+        RegAPI.createUser for the arguments."""
+    data = {
+        "username": username,
+        "last_name_id": lastNameId or RegAPI.LASTNAME_RESIDENT
+    }
+    if estate:
+        data["limited_to_estate"] = estate
+    
+    if region:
+        data["start_region_name"] = region
+    
+    if location:
+        data["start_local_x"] = float(location[0])
+        data["start_local_y"] = float(location[1])
+        data["start_local_z"] = float(location[2])
+    
+    if lookAt:
+        data["start_look_at_x"] = float(lookAt[0])
+        data["start_look_at_y"] = float(lookAt[1])
+        data["start_look_at_z"] = float(lookAt[2])
+    
+    if marketing:
+        data["marketing_emails"] = marketing
+    
+    if successUrl:
+        data["success_url"] = llsd.URI(successUrl)
+    
+    if errorUrl:
+        data["error_url"] = llsd.URI(errorUrl)
+    
+    if maturity:
+        data["maximum_maturity"] = maturity
+    
+    return data
+
+def resolveError(catalogs, errCode):
+    """Internal function, make the RegAPIError for errCode from the error codes
+        loaded in catalogs."""
+    error = catalogs.error(errCode)
+    if error == None:
+        return RegAPIError("Unknown Error", "Couldn't resolve the error message!")
+    return RegAPIError(error[0], error[1], code = errCode)
+
+def cachedName(nameCache, username, lastNameId):
+    """Internal function, look username up in a NameCache. Returns None if
+        it is not there, raises a copy of the RegAPIError it was taken with."""
+    result = nameCache.get(username, lastNameId)
+    if isinstance(result, RegAPIError):
+        raise copyError(result)
+    return result
+
+def copyError(error):
+    """Internal function, copy a RegAPIError without its traceback, so it can
+        be kept and raised again."""
+    return RegAPIError(error.expression, error.message, code = error.code)
+
 class RegAPI:
     """The RegAPI class, the big feature, the whole burrito!"""
     LASTNAME_RESIDENT = 10327
@@ -110,15 +216,48 @@ class RegAPI:
         "user-agent": "RegAPI Library (Python Edition) By Kyler Eastridge"
     }
     
-    def __init__(self, capabilities = None, cache = None):
+    #Request bodies that always have the same keys
+    checkNameTemplate = llsd.compileTemplate(("username", "last_name_id"))
+    agentTemplate = llsd.compileTemplate(("agent_id",))
+    avatarTemplate = llsd.compileTemplate(("agent_id", "avatar_id"))
+    experienceTemplate = llsd.compileTemplate(("agent_id", "experience_id"))
+    groupTemplate = llsd.compileTemplate(("first", "last", "group_name"))
+    
+    def __init__(self, capabilities = None, cache = None, pool = None,
+                    nameCache = None, catalogTTL = 60*60,
+                    catalogMaxAge = 24*60*60, catalogJitter = 0.1):
         """Capabilities is a dictionary of capabilities provided by
             get_reg_capabilities. Cache is a caching object, see caching for
             more information.
+            Pool is a httppool.ConnectionPool to send requests over. A new
+            one is made if it is not given, pass False to open a new
+            connection with urlopen for every request instead.
+            nameCache is an optional namecache.NameCache that checkName
+            answers from when it can.
+            catalogTTL is how many seconds the catalogs are used before they
+            are revalidated with the server, None to keep them forever.
+            After that they are still returned at once while a background
+            thread revalidates them, until they are catalogMaxAge seconds
+            old. catalogJitter is the fraction of catalogTTL revalidations
+            are randomly brought forward by.
         """
         if capabilities == None:
             capabilities = []
+        if pool == None:
+            pool = httppool.ConnectionPool()
         self.capabilities = capabilities
         self.cache = cache
+        self.pool = pool
+        self.nameCache = nameCache
+        self.catalogs = Catalogs()
+        self.catalogTTL = catalogTTL
+        self.catalogMaxAge = catalogMaxAge
+        self.catalogJitter = catalogJitter
+        self.refresher = None
+        self.lock = threading.Lock()
+        self.revalidating = set()
+        self.executor = None
+        self.flights = SingleFlight()
     
     def getCapabilities(self, username, password, IKnowWhatIAmDoing = False):
         """This is a utility function to get the RegAPI capabilities.
@@ -148,8 +287,8 @@ leaked if the server becomes misconfiguration or hacked!\
         )
         
         result = None
-        with doRequest(req) as res:
-            result = llsd.llsdDecode(res.read())
+        with doRequest(req, pool = self.pool) as res:
+            result = llsd.load(res)
         #This is funny, but correct.
         #If the request is invalid, it returns an error, but we can only get
         #the error codes after we have successfully get our capabilities.
@@ -168,122 +307,135 @@ leaked if the server becomes misconfiguration or hacked!\
             raise RegAPIError("No capability '{}'!".format(cap))
         return self.capabilities[cap]
     
-    def getErrorCodes(self):
-        """Returns a list of error codes in [[code, name, desc],...] format."""
-        cap = self.getCapability("get_error_codes")
-        result = None
+    def getCatalog(self, cap, refresh = False):
+        """Internal function, returns a catalog capability from memory, the
+            cache or the server, in that order. Once it is older than
+            catalogTTL it is revalidated with the server in the background,
+            and only downloaded again if it changed. Past catalogMaxAge, or
+            if refresh is True, it is revalidated before returning."""
+        url = self.getCapability(cap)
+        entry = self.catalogs.entries.get(cap)
+        if entry == None and self.cache:
+            entry = self.cache.get(Catalogs.cacheKey(cap))
+            if entry:
+                self.catalogs.update(cap, entry)
+        if entry and not refresh:
+            freshness = Catalogs.freshness(entry, self.catalogTTL,
+                self.catalogMaxAge, self.catalogJitter)
+            if freshness == Catalogs.STALE:
+                self.revalidateLater(cap)
+            if freshness != Catalogs.EXPIRED:
+                return self.catalogs.get(cap)
+        
+        return self.flights.do(("catalog", cap), self.fetchCatalog, cap, url, entry)
+    
+    def fetchCatalog(self, cap, url, entry):
+        """Internal function, request a catalog capability, conditionally if
+            there is a previous entry. Concurrent callers share one request."""
+        req = urllib.request.Request(
+            url,
+            headers = {
+                **self.baseHeaders,
+                **Catalogs.validators(entry)
+            }
+        )
+        with doRequest(req, pool = self.pool) as res:
+            if entry and res.getcode() == 304:
+                entry = Catalogs.revalidated(entry, res.headers)
+            else:
+                result = llsd.load(res)
+                if Catalogs.converters[cap] and type(result) == list:
+                    raise self.getError(result[0])
+                entry = Catalogs.makeEntry(result, res.headers)
+        
         if self.cache:
-            result = self.cache.get("get_error_codes")
+            #Kept past the cache expiry, its age is judged by catalogMaxAge
+            #and its validators still save a download once it is stale
+            self.cache.set(Catalogs.cacheKey(cap), entry, ttl = 0)
         
-        if not result:
-            req = urllib.request.Request(
-                cap,
-                headers = {
-                    **self.baseHeaders
-                }
-            )
-            with doRequest(req) as res:
-                result = llsd.llsdDecode(res.read())
+        return self.catalogs.update(cap, entry)
+    
+    def revalidateLater(self, cap):
+        """Internal function, revalidate a catalog in the background unless
+            that is already happening."""
+        with self.lock:
+            if cap in self.revalidating:
+                return
+            self.revalidating.add(cap)
+            if self.executor == None:
+                self.executor = concurrent.futures.ThreadPoolExecutor(
+                    max_workers = 1, thread_name_prefix = "RegAPI revalidate")
+        self.executor.submit(self.revalidate, cap)
+    
+    def revalidate(self, cap):
+        try:
+            self.getCatalog(cap, refresh = True)
+        except (Exception, RegAPIError):
+            #Keep serving the stale catalog until it expires
+            pass
+        finally:
+            with self.lock:
+                self.revalidating.discard(cap)
+    
+    def warmUp(self, refresh = None):
+        """Fetch every catalog there is a capability for at once, so later
+            calls and error lookups are answered from memory.
+            If refresh is given, fetch them again every refresh seconds in a
+            background thread until stopRefresh() is called.
+        """
+        caps = [cap for cap in Catalogs.converters if cap in self.capabilities]
+        if caps:
+            with concurrent.futures.ThreadPoolExecutor(max_workers = len(caps)) as executor:
+                for future in [executor.submit(self.getCatalog, cap) for cap in caps]:
+                    future.result()
+        
+        if refresh and not self.refresher:
+            stop = threading.Event()
             
-            if self.cache:
-                self.cache.set("get_error_codes", result)
-        
-        return result
+            def refreshLoop():
+                while not stop.wait(refresh):
+                    for cap in caps:
+                        try:
+                            self.getCatalog(cap, refresh = True)
+                        except (Exception, RegAPIError):
+                            #Keep serving the catalog we have
+                            pass
+            
+            thread = threading.Thread(target = refreshLoop, daemon = True,
+                name = "RegAPI catalog refresh")
+            self.refresher = stop
+            thread.start()
+    
+    def stopRefresh(self):
+        """Stop the background refresh started by warmUp."""
+        if self.refresher:
+            self.refresher.set()
+            self.refresher = None
+    
+    def getErrorCodes(self):
+        """Returns a list of error codes in [[code, name, desc],...] format."""
+        return self.getCatalog("get_error_codes")
     
     def getError(self, errCode):
         """Helper function. Resolve a error code by ID."""
-        for code in self.getErrorCodes():
-            if code[0] == errCode:
-                return RegAPIError(code[1], code[2], code = code[0])
-        return RegAPIError("Unknown Error", "Couldn't resolve the error message!")
+        if self.catalogs.get("get_error_codes") == None:
+            self.getErrorCodes()
+        return resolveError(self.catalogs, errCode)
     
     def getLastNames(self):
         """Returns a list of available usernames in {id: "name", ...} format"""
-        cap = self.getCapability("get_last_names")
-        result = None
-        if self.cache:
-            result = self.cache.get("get_last_names")
-        
-        if not result:
-            req = urllib.request.Request(
-                cap,
-                headers = {
-                    **self.baseHeaders
-                }
-            )
-            with doRequest(req) as res:
-                result = llsd.llsdDecode(res.read())
-            
-            if type(result) == list:
-                raise self.getError(result[0])
-            
-            #Convert the keys from strings to integers
-            result = {int(k): v for k, v in result.items()}
-            
-            if self.cache:
-                self.cache.set("get_last_names", result)
-        
-        return result
+        return self.getCatalog("get_last_names")
     
     def getExperiences(self):
         """Returns a list of experiences the capability has access to in
             {id: "name"} format
         """
-        cap = self.getCapability("get_experiences")
-        result = None
-        if self.cache:
-            result = self.cache.get("get_experiences")
-        
-        if not result:
-            req = urllib.request.Request(
-                cap,
-                headers = {
-                    **self.baseHeaders
-                }
-            )
-            
-            if type(result) == list:
-                raise self.getError(result[0])
-            
-            with doRequest(req) as res:
-                result = llsd.llsdDecode(res.read())
-            
-            #Convert the keys from strings to UUIDs
-            result = {uuid.UUID(k): v for k, v in result.items()}
-            
-            if self.cache:
-                self.cache.set("get_experiences", result)
-        
-        return result
+        return self.getCatalog("get_experiences")
     
     def getAvatars(self):
         """Returns a list of available starting avatars in {id: "name"} format
         """
-        cap = self.getCapability("get_avatars")
-        result = None
-        if self.cache:
-            result = self.cache.get("get_avatars")
-        
-        if not result:
-            req = urllib.request.Request(
-                cap,
-                headers = {
-                    **self.baseHeaders
-                }
-            )
-            with doRequest(req) as res:
-                result = llsd.llsdDecode(res.read())
-            
-            if type(result) == list:
-                raise self.getError(result[0])
-            
-            #Convert the keys from strings to UUIDs
-            result = {uuid.UUID(k): v for k, v in result.items()}
-            
-            if self.cache:
-                self.cache.set("get_avatars", result)
-        
-        return result
+        return self.getCatalog("get_avatars")
     
     def checkName(self, username, lastNameId = None):
         """Check if a username is available. Automatically assumes resident is
@@ -292,6 +444,18 @@ leaked if the server becomes misconfiguration or hacked!\
             Might return False if not available!
         """
         cap = self.getCapability("check_name")
+        lastNameId = lastNameId or self.LASTNAME_RESIDENT
+        if self.nameCache:
+            result = cachedName(self.nameCache, username, lastNameId)
+            if result != None:
+                return result
+        
+        #Concurrent checks of the same name share one request
+        return self.flights.do(("check_name", username.lower(), lastNameId),
+            self.requestName, cap, username, lastNameId)
+    
+    def requestName(self, cap, username, lastNameId):
+        """Internal function, the check_name request behind checkName."""
         result = None
         req = urllib.request.Request(
             cap,
@@ -300,20 +464,88 @@ leaked if the server becomes misconfiguration or hacked!\
                 "content-type": "application/llsd+xml"
             },
             method = "POST",
-            data = llsd.llsdEncode({
-                "username": username,
-                "last_name_id": lastNameId or self.LASTNAME_RESIDENT
-            })
+            data = self.checkNameTemplate.encode(username, lastNameId)
         )
         
-        with doRequest(req) as res:
-            result = llsd.llsdDecode(res.read())
+        with doRequest(req, pool = self.pool) as res:
+            result = llsd.load(res)
         
         if type(result) == list:
-            raise self.getError(result[0])
+            error = self.getError(result[0])
+            if self.nameCache:
+                self.nameCache.set(username, lastNameId, copyError(error))
+            raise error
+        
+        if self.nameCache:
+            self.nameCache.set(username, lastNameId, result)
         
         return result
     
+    def checkNames(self, candidates, lastNameId = None, concurrency = 8,
+                    stopAfter = None):
+        """Check many usernames at once, concurrency requests at a time over
+            the shared connections.
+            A candidate is a username or a (username, lastNameId) tuple.
+            Returns an OrderedDict of {candidate: result} in the order of
+            candidates, result being what checkName returned or the
+            RegAPIError it raised.
+            If stopAfter is given, stop once the first stopAfter available
+            names in the order of candidates are known, that is once they and
+            every candidate before them have been checked. Only those
+            candidates are returned, the ones after them are left out even
+            if they were checked.
+        """
+        candidates = list(dict.fromkeys(candidates))
+        results = {}
+        #candidates[:settled] all have results
+        settled = 0
+        available = 0
+        with concurrent.futures.ThreadPoolExecutor(max_workers = concurrency) as executor:
+            futures = {}
+            for name in candidates:
+                if type(name) == tuple:
+                    futures[executor.submit(self.checkName, *name)] = name
+                else:
+                    futures[executor.submit(self.checkName, name, lastNameId)] = name
+            try:
+                for future in concurrent.futures.as_completed(futures):
+                    name = futures[future]
+                    try:
+                        results[name] = future.result()
+                    except RegAPIError as e:
+                        results[name] = e
+                    while settled < len(candidates) and candidates[settled] in results \
+                            and not (stopAfter and available >= stopAfter):
+                        if results[candidates[settled]] == True:
+                            available += 1
+                        settled += 1
+                    if stopAfter and available >= stopAfter:
+                        candidates = candidates[:settled]
+                        break
+            finally:
+                for future in futures:
+                    future.cancel()
+        
+        return collections.OrderedDict((name, results[name])
+            for name in candidates if name in results)
+    
+    def suggestNames(self, base, count = 5, lastNames = None, concurrency = 8,
+                    limit = 50):
+        """Suggest up to count available usernames like base, best first.
+            Candidates come from generateNameVariants, using lastNames or the
+            getLastNames catalog if there is a get_last_names capability.
+            Returns a list of (username, lastNameId), the first count
+            candidates that are available in the order generateNameVariants
+            ranks them, however quickly each check answers.
+        """
+        if lastNames == None and "get_last_names" in self.capabilities:
+            lastNames = self.getLastNames()
+        candidates = generateNameVariants(base, lastNames, limit)
+        results = self.checkNames(candidates, concurrency = concurrency,
+            stopAfter = count)
+        return [candidate for candidate, result in results.items()
+            if result == True][:count]
+    
     def createUser(self, username, lastNameId = None,
                     estate = None, region = None, location = None,
                     lookAt = None, marketing = None, successUrl = None,
@@ -331,37 +563,8 @@ leaked if the server becomes misconfiguration or hacked!\
         """
         cap = self.getCapability("create_user")
         result = None
-        data = {
-            "username": username,
-            "last_name_id": lastNameId or self.LASTNAME_RESIDENT
-        }
-        if estate:
-            data["limited_to_estate"] = estate
-        
-        if region:
-            data["start_region_name"] = region
-        
-        if location:
-            data["start_local_x"] = float(location[0])
-            data["start_local_y"] = float(location[1])
-            data["start_local_z"] = float(location[2])
-        
-        if lookAt:
-            data["start_look_at_x"] = float(lookAt[0])
-            data["start_look_at_y"] = float(lookAt[1])
-            data["start_look_at_z"] = float(lookAt[2])
-        
-        if marketing:
-            data["marketing_emails"] = marketing
-        
-        if successUrl:
-            data["success_url"] = llsd.URI(successUrl)
-        
-        if errorUrl:
-            data["error_url"] = llsd.URI(errorUrl)
-        
-        if maturity:
-            data["maximum_maturity"] = maturity
+        data = createUserData(username, lastNameId, estate, region, location,
+            lookAt, marketing, successUrl, errorUrl, maturity)
         
         req = urllib.request.Request(
             cap,
@@ -373,12 +576,15 @@ leaked if the server becomes misconfiguration or hacked!\
             data = llsd.llsdEncode(data)
         )
         
-        with doRequest(req) as res:
-            result = llsd.llsdDecode(res.read())
+        with doRequest(req, pool = self.pool) as res:
+            result = llsd.load(res)
         
         if type(result) == list:
             raise self.getError(result[0])
         
+        if self.nameCache:
+            self.nameCache.invalidate(username, lastNameId or self.LASTNAME_RESIDENT)
+        
         return result
     
     def regenerateUserNonce(self, agentId):
@@ -395,13 +601,11 @@ leaked if the server becomes misconfiguration or hacked!\
                 "content-type": "application/llsd+xml"
             },
             method = "POST",
-            data = llsd.llsdEncode({
-                "agent_id": agentId
-            })
+            data = self.agentTemplate.encode(agentId)
         )
         
-        with doRequest(req) as res:
-            result = llsd.llsdDecode(res.read())
+        with doRequest(req, pool = self.pool) as res:
+            result = llsd.load(res)
         
         if type(result) == list:
             raise self.getError(result[0])
@@ -423,14 +627,11 @@ leaked if the server becomes misconfiguration or hacked!\
                 "content-type": "application/llsd+xml"
             },
             method = "POST",
-            data = llsd.llsdEncode({
-                "agent_id": agentId,
-                "avatar_id": avatarId,
-            })
+            data = self.avatarTemplate.encode(agentId, avatarId)
         )
         
-        with doRequest(req) as res:
-            result = llsd.llsdDecode(res.read())
+        with doRequest(req, pool = self.pool) as res:
+            result = llsd.load(res)
         
         if type(result) == list:
             raise self.getError(result[0])
@@ -453,14 +654,11 @@ leaked if the server becomes misconfiguration or hacked!\
                 "content-type": "application/llsd+xml"
             },
             method = "POST",
-            data = llsd.llsdEncode({
-                "agent_id": agentId,
-                "experience_id": experienceId,
-            })
+            data = self.experienceTemplate.encode(agentId, experienceId)
         )
         
-        with doRequest(req) as res:
-            result = llsd.llsdDecode(res.read())
+        with doRequest(req, pool = self.pool) as res:
+            result = llsd.load(res)
         
         if type(result) == list:
             raise self.getError(result[0])
@@ -483,15 +681,12 @@ leaked if the server becomes misconfiguration or hacked!\
                 "content-type": "application/llsd+xml"
             },
             method = "POST",
-            data = llsd.llsdEncode({
-                "first": username[0],
-                "last": username[1],
-                "group_name": groupName
-            })
+            data = self.groupTemplate.encode(username[0], username[1],
+                groupName)
         )
         
-        with doRequest(req) as res:
-            result = llsd.llsdDecode(res.read())
+        with doRequest(req, pool = self.pool) as res:
+            result = llsd.load(res)
         
         if type(result) == list:
             raise self.getError(result[0])
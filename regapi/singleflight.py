@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+Name: singleflight.py
+Purpose: Coalesce concurrent identical calls into one
+
+Copyright (c) 2021 Kyler Eastridge
+
+This software is provided 'as-is', without any express or implied
+warranty. In no event will the authors be held liable for any damages
+arising from the use of this software.
+
+Permission is granted to anyone to use this software for any purpose,
+including commercial applications, and to alter it and redistribute it
+freely, subject to the following restrictions:
+
+1. The origin of this software must not be misrepresented; you must not
+   claim that you wrote the original software. If you use this software
+   in a product, an acknowledgment in the product documentation would be
+   appreciated but is not required.
+2. Altered source versions must be plainly marked as such, and must not be
+   misrepresented as being the original software.
+3. This notice may not be removed or altered from any source distribution.
+"""
+import asyncio
+import concurrent.futures
+import threading
+
+class SingleFlight:
+    """Runs one call per key at a time. Threads that ask for a key that is
+        already in flight wait for that call and get its result, or its
+        exception, instead of making their own.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        #key: concurrent.futures.Future
+        self.calls = {}
+    
+    def do(self, key, function, *args, **kwargs):
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call == None
+            if leader:
+                call = self.calls[key] = concurrent.futures.Future()
+        if not leader:
+            return call.result()
+        
+        try:
+            result = function(*args, **kwargs)
+        except BaseException as e:
+            call.set_exception(e)
+            raise
+        else:
+            call.set_result(result)
+            return result
+        finally:
+            with self.lock:
+                del self.calls[key]
+
+class AsyncSingleFlight:
+    """The asyncio counterpart of SingleFlight, for coroutine functions. The
+        call keeps running for the others if the caller that started it is
+        cancelled.
+    """
+    def __init__(self):
+        #key: asyncio.Task
+        self.calls = {}
+    
+    async def do(self, key, function, *args, **kwargs):
+        call = self.calls.get(key)
+        if call == None:
+            call = self.calls[key] = asyncio.ensure_future(function(*args, **kwargs))
+            call.add_done_callback(lambda call: self.done(key, call))
+        return await asyncio.shield(call)
+    
+    def done(self, key, call):
+        if self.calls.get(key) is call:
+            del self.calls[key]
+        if not call.cancelled():
+            #Nobody may be left to see it
+            call.exception()
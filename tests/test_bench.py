@@ -0,0 +1,43 @@
+import json
+import os
+import tempfile
+import unittest
+
+from regapi import bench, llsd
+
+class CorpusTest(unittest.TestCase):
+    def testReproducible(self):
+        first = bench.makeCorpus(seed = 3)
+        self.assertEqual(list(first), list(bench.corpora))
+        self.assertEqual(first, bench.makeCorpus(seed = 3))
+        self.assertNotEqual(first, bench.makeCorpus(seed = 4))
+        #A corpus does not depend on which others are generated with it
+        self.assertEqual(bench.makeCorpus(["deep"], seed = 3)["deep"], first["deep"])
+
+    def testEncodable(self):
+        for name, value in bench.makeCorpus().items():
+            for format in ("xml", "binary", "notation"):
+                with self.subTest(corpus = name, format = format):
+                    llsd.llsdEncode(value, format = format)
+
+class RunTest(unittest.TestCase):
+    def testRunAndCompare(self):
+        results = bench.run(["registration"], number = 1, repeat = 1)
+        self.assertEqual(len(results["results"]), len(bench.paths))
+        json.dumps(results)
+        self.assertEqual(bench.compare(results, results), [])
+        slower = json.loads(json.dumps(results))
+        slower["results"][0]["seconds"] *= 2
+        regressions = bench.compare(results, slower)
+        self.assertEqual([regression["field"] for regression in regressions], ["seconds"])
+
+    def testMain(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "results.json")
+            self.assertEqual(bench.main(["--corpus", "registration", "--number", "1",
+                "--repeat", "1", "--quiet", "--output", path]), 0)
+            with open(path) as f:
+                self.assertEqual(json.load(f)["seed"], 0)
+
+if __name__ == "__main__":
+    unittest.main()
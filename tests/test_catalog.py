@@ -0,0 +1,172 @@
+import http.server
+import os
+import tempfile
+import threading
+import time
+import unittest
+import uuid
+
+from regapi import RegAPI, RegAPIError, llsd
+from regapi.catalog import Catalogs
+from regapi.filecache import FileCache
+
+AVATAR = uuid.UUID(int = 1)
+
+CATALOGS = {
+    "/avatars": {str(AVATAR): "Fox"},
+    "/last_names": {"10327": "Resident", "10328": "Wolf"},
+    "/error_codes": [[5, "Username taken", "Pick another one"]],
+}
+
+class CatalogHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        super().setup()
+        self.server.connections += 1
+
+    def do_GET(self):
+        time.sleep(self.server.delay)
+        self.server.requests.append(self.headers.get("if-none-match"))
+        if self.headers.get("if-none-match") == '"1"':
+            self.send_response(304)
+            self.send_header("ETag", '"1"')
+            self.end_headers()
+            return
+        body = llsd.llsdEncode(CATALOGS[self.path])
+        self.send_response(200)
+        self.send_header("ETag", '"1"')
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+class CatalogServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), CatalogHandler)
+        self.connections = 0
+        self.requests = []
+        self.delay = 0
+        threading.Thread(target = self.serve_forever, daemon = True).start()
+
+    def url(self, path = "/avatars"):
+        return "http://127.0.0.1:{}{}".format(self.server_address[1], path)
+
+class CatalogsTest(unittest.TestCase):
+    def testIndexes(self):
+        catalogs = Catalogs()
+        self.assertIsNone(catalogs.error(5))
+        for path, cap in (("/avatars", "get_avatars"), ("/last_names", "get_last_names"),
+                ("/error_codes", "get_error_codes")):
+            catalogs.update(cap, Catalogs.makeEntry(CATALOGS[path], {}))
+        self.assertEqual(catalogs.error(5), ("Username taken", "Pick another one"))
+        self.assertIsNone(catalogs.error(6))
+        self.assertEqual(catalogs.lastName(10328), "Wolf")
+        self.assertEqual(catalogs.lastNameId("WOLF"), 10328)
+        self.assertIsNone(catalogs.lastNameId("Fox"))
+        self.assertEqual(catalogs.avatarName(AVATAR), "Fox")
+        self.assertIsNone(catalogs.experienceName(AVATAR))
+
+    def testUnchangedEntryKeepsValue(self):
+        catalogs = Catalogs()
+        entry = Catalogs.makeEntry(CATALOGS["/avatars"], {"etag": '"1"'})
+        value = catalogs.update("get_avatars", entry)
+        entry = Catalogs.revalidated(entry, {})
+        self.assertIs(catalogs.update("get_avatars", entry), value)
+        self.assertEqual(Catalogs.validators(entry), {"if-none-match": '"1"'})
+
+class WarmUpTest(unittest.TestCase):
+    def setUp(self):
+        self.server = CatalogServer()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def testAnswersFromMemory(self):
+        api = RegAPI({
+            "get_avatars": self.server.url("/avatars"),
+            "get_last_names": self.server.url("/last_names"),
+            "get_error_codes": self.server.url("/error_codes"),
+        }, pool = False)
+        api.warmUp()
+        self.assertEqual(len(self.server.requests), 3)
+        error = api.getError(5)
+        self.assertIsInstance(error, RegAPIError)
+        self.assertEqual((error.expression, error.code), ("Username taken", 5))
+        self.assertEqual(api.getLastNames()[10327], "Resident")
+        self.assertEqual(api.getAvatars(), {AVATAR: "Fox"})
+        self.assertEqual(len(self.server.requests), 3)
+
+class RevalidationTest(unittest.TestCase):
+    def setUp(self):
+        self.server = CatalogServer()
+        self.api = RegAPI({"get_avatars": self.server.url()})
+
+    def tearDown(self):
+        self.api.pool.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def testNotModifiedKeepsEntryAndConnection(self):
+        self.assertEqual(self.api.getAvatars(), {AVATAR: "Fox"})
+        for i in range(5):
+            self.assertEqual(self.api.getCatalog("get_avatars", refresh = True),
+                {AVATAR: "Fox"})
+        self.assertEqual(self.server.requests, [None] + ['"1"'] * 5)
+        self.assertEqual(self.server.connections, 1)
+
+    def testEntryOutlivesCacheExpiry(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "cache")
+            with FileCache(path = path, expiry = 0.2) as cache:
+                api = RegAPI({"get_avatars": self.server.url()}, cache = cache,
+                    pool = False, catalogTTL = 0.1)
+                self.assertEqual(api.getAvatars(), {AVATAR: "Fox"})
+            time.sleep(0.3)
+            with FileCache(path = path, expiry = 0.2) as cache:
+                api = RegAPI({"get_avatars": self.server.url()}, cache = cache,
+                    pool = False, catalogTTL = 0.1, catalogMaxAge = 0.1)
+                self.assertEqual(api.getAvatars(), {AVATAR: "Fox"})
+        self.assertEqual(self.server.requests, [None, '"1"'])
+
+class StaleTest(unittest.TestCase):
+    def setUp(self):
+        self.server = CatalogServer()
+        self.api = RegAPI({"get_avatars": self.server.url()}, pool = False,
+            catalogTTL = 0.1, catalogMaxAge = 0.6, catalogJitter = 0)
+        self.assertEqual(self.api.getAvatars(), {AVATAR: "Fox"})
+        self.server.delay = 0.3
+        time.sleep(0.15)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def testStaleIsServedWhileRevalidating(self):
+        start = time.monotonic()
+        for i in range(3):
+            self.assertEqual(self.api.getAvatars(), {AVATAR: "Fox"})
+        self.assertLess(time.monotonic() - start, 0.2)
+        #One background revalidation however many calls saw it stale
+        deadline = time.monotonic() + 5
+        while (self.api.revalidating or len(self.server.requests) < 2) \
+                and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(self.server.requests, [None, '"1"'])
+        self.assertEqual(Catalogs.freshness(self.api.catalogs.entries["get_avatars"],
+            self.api.catalogTTL), Catalogs.FRESH)
+
+    def testExpiredIsRevalidatedFirst(self):
+        time.sleep(0.5)
+        start = time.monotonic()
+        self.assertEqual(self.api.getAvatars(), {AVATAR: "Fox"})
+        self.assertGreaterEqual(time.monotonic() - start, 0.3)
+        self.assertEqual(self.server.requests, [None, '"1"'])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,72 @@
+import asyncio
+import random
+import time
+import unittest
+
+from regapi import RegAPI, AsyncRegAPI, RegAPIError
+
+TAKEN = {"Taken1", "Taken3"}
+
+def answer(username):
+    if username in TAKEN:
+        raise RegAPIError("Username taken", "Taken", 1)
+    return True
+
+class CheckNamesTest(unittest.TestCase):
+    candidates = ["Taken1", "Free2", "Taken3", "Free4", "Free5", "Free6",
+        "Free7", "Free8"]
+
+    def makeAPI(self):
+        api = RegAPI(pool = False)
+        def checkName(username, lastNameId = None):
+            #Later candidates tend to answer first
+            time.sleep(random.random() * 0.01 / (self.candidates.index(username) + 1))
+            return answer(username)
+        api.checkName = checkName
+        return api
+
+    def testStopAfterKeepsCandidateOrder(self):
+        api = self.makeAPI()
+        for i in range(5):
+            results = api.checkNames(self.candidates, concurrency = 8, stopAfter = 2)
+            self.assertEqual(list(results), self.candidates[:4])
+            self.assertIsInstance(results["Taken3"], RegAPIError)
+            self.assertEqual([name for name, result in results.items()
+                if result == True], ["Free2", "Free4"])
+
+    def testWithoutStopAfter(self):
+        results = self.makeAPI().checkNames(self.candidates)
+        self.assertEqual(list(results), self.candidates)
+
+class SuggestNamesTest(unittest.TestCase):
+    def testRankedBestFirst(self):
+        api = RegAPI(pool = False)
+        def checkName(username, lastNameId = None):
+            #Every name is free, the best ones answer last
+            time.sleep(0.02 if username in ("Felix", "FelixWolf") else random.random() * 0.005)
+            return True
+        api.checkName = checkName
+        self.assertEqual(api.suggestNames("Felix Wolf", 3, lastNames = {}),
+            [("Felix", RegAPI.LASTNAME_RESIDENT),
+             ("FelixWolf", RegAPI.LASTNAME_RESIDENT),
+             ("FelixW", RegAPI.LASTNAME_RESIDENT)])
+
+class AsyncCheckNamesTest(unittest.TestCase):
+    candidates = CheckNamesTest.candidates
+
+    def testStopAfterKeepsCandidateOrder(self):
+        async def run():
+            api = AsyncRegAPI(pool = object())
+            async def checkName(username, lastNameId = None):
+                await asyncio.sleep(random.random() * 0.01
+                    / (self.candidates.index(username) + 1))
+                return answer(username)
+            api.checkName = checkName
+            return await api.checkNames(self.candidates, stopAfter = 2)
+
+        for i in range(5):
+            results = asyncio.run(run())
+            self.assertEqual(list(results), self.candidates[:4])
+
+if __name__ == "__main__":
+    unittest.main()
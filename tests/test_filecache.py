@@ -0,0 +1,139 @@
+import concurrent.futures
+import os
+import pickle
+import tempfile
+import time
+import unittest
+
+from regapi.filecache import FileCache, PickleBackend, backends
+
+def writeKeys(path, backend, worker, count):
+    with FileCache(path = path, backend = backend, shared = True) as cache:
+        for i in range(count):
+            cache.set("{}-{}".format(worker, i), i)
+
+class FileCacheBackendTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def open(self, backend, **kwargs):
+        path = os.path.join(self.directory.name, "cache." + backend)
+        return FileCache(path = path, backend = backend, **kwargs)
+
+    def testRoundTripAndReopen(self):
+        value = {"name": "FelixWolf", "id": 5, "list": [1, 2.5, "three"]}
+        for backend in backends:
+            with self.subTest(backend = backend):
+                with self.open(backend) as cache:
+                    cache.set("a", value)
+                    cache.set("b", "gone")
+                    cache.delete("b")
+                    self.assertEqual(cache.get("a"), value)
+                    self.assertIsNone(cache.get("b"))
+                with self.open(backend) as cache:
+                    self.assertEqual(cache.get("a"), value)
+                    self.assertIsNone(cache.get("b"))
+                    self.assertEqual(cache.keys(), ["a"])
+
+    def testWriteBehindReopen(self):
+        for backend in backends:
+            with self.subTest(backend = backend):
+                with self.open(backend, writeBehind = 60) as cache:
+                    for i in range(10):
+                        cache.set("key{}".format(i), i)
+                with self.open(backend) as cache:
+                    self.assertEqual(sorted(cache.keys()),
+                        sorted("key{}".format(i) for i in range(10)))
+                    self.assertEqual(cache.get("key3"), 3)
+
+    def testDefaultBackend(self):
+        path = os.path.join(self.directory.name, "default")
+        with FileCache(path = path) as cache:
+            self.assertIsInstance(cache.backend, PickleBackend)
+            cache.set(("tuple", 1), (1 << 40, {1: 2}))
+            self.assertEqual(cache.get(("tuple", 1)), (1 << 40, {1: 2}))
+
+    def testReadsOlderCaches(self):
+        path = os.path.join(self.directory.name, "old.fc")
+        with open(path, "wb") as f:
+            pickle.dump({"a": {"updated": time.time(), "data": [1, 2]}}, f)
+        with FileCache(path = path) as cache:
+            self.assertEqual(cache.get("a"), [1, 2])
+
+    def testMappedRejectsBeforeMemory(self):
+        for writeBehind in (None, 60):
+            with self.subTest(writeBehind = writeBehind):
+                with self.open("mapped", writeBehind = writeBehind) as cache:
+                    for key, value in ((1, "x"), ("a", (1, 2)), ("b", 1 << 40)):
+                        with self.assertRaises(ValueError):
+                            cache.set(key, value)
+                        self.assertIsNone(cache.get(key))
+                    self.assertEqual(cache.keys(), [])
+
+    def testExpiry(self):
+        with self.open("log", expiry = 60) as cache:
+            cache.set("default", 1)
+            cache.set("never", 2, ttl = 0)
+            cache.set("gone", 3, ttl = -1)
+            self.assertIn("expires", cache.data["default"])
+            self.assertNotIn("expires", cache.data["never"])
+            self.assertIsNone(cache.get("gone"))
+        for expiry in (None, 0):
+            with self.subTest(expiry = expiry):
+                with self.open("log", expiry = expiry) as cache:
+                    cache.set("a", 1)
+                    self.assertNotIn("expires", cache.data["a"])
+
+    def testSizesOnlyWithMaxBytes(self):
+        with self.open("log") as cache:
+            cache.set("a", "x" * 1000)
+            self.assertEqual(cache.sizes, {})
+        with self.open("log", maxBytes = 1500) as cache:
+            cache.set("b", "x" * 1000)
+            cache.set("c", "x" * 1000)
+            self.assertEqual(list(cache.sizes), ["c"])
+            self.assertEqual(cache.get("a"), "x" * 1000)
+
+class SharedTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def path(self, backend):
+        return os.path.join(self.directory.name, "shared." + backend)
+
+    def testInstancesSeeEachOther(self):
+        for backend in backends:
+            with self.subTest(backend = backend):
+                path = self.path(backend)
+                with FileCache(path = path, backend = backend, shared = True) as a, \
+                        FileCache(path = path, backend = backend, shared = True) as b:
+                    a.set("a", 1)
+                    self.assertEqual(b.get("a"), 1)
+                    b.set("b", [2])
+                    self.assertEqual(a.get("b"), [2])
+                    a.set("a", 3)
+                    self.assertEqual(b.get("a"), 3)
+                    b.delete("a")
+                    self.assertIsNone(a.get("a"))
+                    self.assertEqual(sorted(a.keys()), ["b"])
+
+    def testProcessesDoNotLoseWrites(self):
+        for backend in backends:
+            with self.subTest(backend = backend):
+                path = self.path(backend)
+                with concurrent.futures.ProcessPoolExecutor(4) as executor:
+                    for future in [executor.submit(writeKeys, path, backend, worker, 25)
+                            for worker in range(4)]:
+                        future.result()
+                with FileCache(path = path, backend = backend) as cache:
+                    self.assertEqual(len(cache.keys()), 100)
+                    self.assertEqual(cache.get("3-24"), 24)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,104 @@
+import asyncio
+import socket
+import threading
+import unittest
+import urllib.error
+import urllib.request
+
+from regapi.httppool import ConnectionPool, AsyncConnectionPool
+
+class DroppingServer:
+    """Answers the first request on each connection and drops the
+        connection without answering the second, like a server that acted on
+        a request and then reset."""
+    def __init__(self):
+        self.socket = socket.socket()
+        self.socket.bind(("127.0.0.1", 0))
+        self.socket.listen()
+        self.port = self.socket.getsockname()[1]
+        self.received = []
+        threading.Thread(target = self.serve, daemon = True).start()
+
+    def serve(self):
+        while True:
+            try:
+                connection, address = self.socket.accept()
+            except OSError:
+                return
+            threading.Thread(target = self.handle, args = (connection,),
+                daemon = True).start()
+
+    def handle(self, connection):
+        with connection, connection.makefile("rb") as f:
+            for i in range(2):
+                line = f.readline()
+                if not line:
+                    return
+                length = 0
+                while True:
+                    header = f.readline()
+                    if header in (b"\r\n", b""):
+                        break
+                    name, _, value = header.partition(b":")
+                    if name.strip().lower() == b"content-length":
+                        length = int(value)
+                f.read(length)
+                self.received.append(line.split()[0].decode())
+                if i == 0:
+                    connection.sendall(b"HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\nok")
+
+    def url(self):
+        return "http://127.0.0.1:{}/".format(self.port)
+
+    def close(self):
+        self.socket.close()
+
+class RetryTest(unittest.TestCase):
+    def setUp(self):
+        self.server = DroppingServer()
+
+    def tearDown(self):
+        self.server.close()
+
+    def testPostIsNotRetried(self):
+        pool = ConnectionPool()
+        with pool.request(urllib.request.Request(self.server.url(), data = b"a")) as res:
+            self.assertEqual(res.read(), b"ok")
+        with self.assertRaises(urllib.error.URLError):
+            pool.request(urllib.request.Request(self.server.url(), data = b"b"))
+        self.assertEqual(self.server.received, ["POST", "POST"])
+
+    def testGetIsRetried(self):
+        pool = ConnectionPool()
+        for i in range(2):
+            with pool.request(self.server.url()) as res:
+                self.assertEqual(res.read(), b"ok")
+        self.assertEqual(self.server.received, ["GET", "GET", "GET"])
+
+    def testAsyncPostIsNotRetried(self):
+        async def run():
+            pool = AsyncConnectionPool()
+            res = await pool.request("POST", self.server.url(), body = b"a")
+            self.assertEqual(res.body, b"ok")
+            with self.assertRaises(urllib.error.URLError):
+                await pool.request("POST", self.server.url(), body = b"b")
+            res = await pool.request("GET", self.server.url())
+            self.assertEqual(res.body, b"ok")
+            await pool.close()
+        asyncio.run(run())
+        self.assertEqual(self.server.received, ["POST", "POST", "GET"])
+
+class AsyncConnectTest(unittest.TestCase):
+    def testRefusedConnection(self):
+        listener = socket.socket()
+        listener.bind(("127.0.0.1", 0))
+        port = listener.getsockname()[1]
+        listener.close()
+        async def run():
+            pool = AsyncConnectionPool()
+            with self.assertRaises(urllib.error.URLError):
+                await pool.request("GET", "http://127.0.0.1:{}/".format(port))
+        asyncio.run(run())
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,273 @@
+import array
+import datetime
+import http.server
+import io
+import struct
+import threading
+import time
+import unittest
+import uuid
+from unittest import mock
+
+from regapi import RegAPI, llsd
+from regapi.httppool import ConnectionPool
+
+class XmlWriterTest(unittest.TestCase):
+    def elementTree(self, value, encoding = "base64"):
+        root = llsd.ET.Element("llsd")
+        llsd.llsdEncodeXml(value, root, optimize = True, encoding = encoding)
+        f = io.BytesIO()
+        llsd.ET.ElementTree(root).write(f, encoding = "UTF-8", xml_declaration = True)
+        return f.getvalue()
+
+    def testBinaryEncodings(self):
+        data = bytes(range(256))
+        for encoding in ("base64", "base85", "base16"):
+            with self.subTest(encoding = encoding):
+                encoded = llsd.llsdEncode(data, encoding = encoding)
+                self.assertEqual(encoded, self.elementTree(data, encoding))
+                self.assertEqual(llsd.llsdDecode(encoded), data)
+
+    def testSameAsElementTree(self):
+        value = {
+            "<&>": ["a < b & c > d", llsd.URI("http://a/?b=1&c=<2>"), "é\U0001f43a"],
+            "": [None, True, False, 0, 7, 0.0, -1.5, "", b"", b"\0\xff"],
+            "uuid": [uuid.UUID(int = 0), uuid.UUID(int = 1)],
+            "date": datetime.datetime(2021, 5, 4, 3, 2, 1, 5),
+            "empty": [{}, []],
+        }
+        encoded = llsd.llsdEncode(value)
+        self.assertEqual(encoded, self.elementTree(value))
+        self.assertEqual(llsd.llsdDecode(encoded), value)
+
+class TemplateTest(unittest.TestCase):
+    def testSameAsEncode(self):
+        for keys, values in (
+                (("username", "last_name_id"), ("F\xe9lix <&>", 10327)),
+                (("agent_id", "avatar_id"), (uuid.UUID(int = 1), None)),
+                (("", "b"), ([1, {"c": b"\0"}], llsd.URI("http://a/?b&c"))),
+                ((), ())):
+            with self.subTest(keys = keys):
+                template = llsd.compileTemplate(keys)
+                expected = llsd.llsdEncode(dict(zip(keys, values)))
+                self.assertEqual(template.encode(*values), expected)
+                self.assertEqual(template.encodeDict(dict(zip(keys, values))), expected)
+
+    def testWrongValues(self):
+        template = llsd.compileTemplate(("a", "b"))
+        with self.assertRaises(ValueError):
+            template.encode(1)
+        with self.assertRaises(ValueError):
+            template.encode(1, object())
+        with self.assertRaises(ValueError):
+            llsd.compileTemplate((1,))
+
+    def testRequestBody(self):
+        api = RegAPI({"check_name": "http://localhost/check_name"}, pool = False)
+        bodies = []
+        def doRequest(req, pool = None):
+            bodies.append(req.data)
+            return io.BytesIO(llsd.llsdEncode(True))
+        with mock.patch("regapi.regapi.doRequest", doRequest):
+            self.assertTrue(api.checkName("FelixWolf", 10327))
+        self.assertEqual(bodies, [llsd.llsdEncode({"username": "FelixWolf",
+            "last_name_id": 10327})])
+
+class Chunked(io.RawIOBase):
+    """A stream without peek() that returns at most size bytes a read."""
+    def __init__(self, data, size):
+        self.data = data
+        self.size = size
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        n = min(len(buffer), self.size, len(self.data))
+        buffer[:n] = self.data[:n]
+        self.data = self.data[n:]
+        return n
+
+class EmptyHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self.send_response(500)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+class LoadTest(unittest.TestCase):
+    value = {"a": [1, 2.5, None, True, "x < y", b"\0\xff", {}, []],
+        "b": {"c": [[]], "d": uuid.UUID(int = 5)}}
+
+    def testSameAsDecode(self):
+        for format in ("xml", "binary", "notation"):
+            with self.subTest(format = format):
+                data = llsd.llsdEncode(self.value, format = format)
+                self.assertEqual(llsd.load(io.BytesIO(data)), self.value)
+                self.assertEqual(llsd.load(io.BufferedReader(io.BytesIO(data))), self.value)
+                self.assertEqual(llsd.load(io.BytesIO(data), chunkSize = 5), self.value)
+                self.assertEqual(llsd.load(Chunked(data, 7), chunkSize = 16), self.value)
+                self.assertEqual(llsd.load(io.BufferedReader(Chunked(data, 8))), self.value)
+
+    def testMalformedMap(self):
+        data = b"<llsd><map><key>a</key></map></llsd>"
+        with self.assertRaises(ValueError):
+            llsd.llsdDecode(data)
+        with self.assertRaises(ValueError):
+            llsd.load(io.BytesIO(data))
+
+    def testEmptyPooledResponse(self):
+        server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), EmptyHandler)
+        threading.Thread(target = server.serve_forever, daemon = True).start()
+        pool = ConnectionPool(timeout = 5)
+        try:
+            start = time.monotonic()
+            with pool.request("http://127.0.0.1:{}/".format(server.server_address[1])) as res:
+                with self.assertRaises(ValueError):
+                    llsd.load(res)
+            self.assertLess(time.monotonic() - start, 2)
+        finally:
+            pool.close()
+            server.shutdown()
+            server.server_close()
+
+class LimitTest(unittest.TestCase):
+    def decoders(self):
+        yield "llsdDecode", llsd.llsdDecode
+        yield "load", lambda data, **kwargs: llsd.load(io.BytesIO(data), **kwargs)
+
+    def testMaxNodes(self):
+        #The array and its 1000 integers
+        data = llsd.llsdEncode(list(range(1000)))
+        for name, decode in self.decoders():
+            with self.subTest(decoder = name):
+                self.assertEqual(len(decode(data, maxNodes = 1001)), 1000)
+                with self.assertRaises(ValueError):
+                    decode(data, maxNodes = 1000)
+
+    def testMaxDepth(self):
+        data = llsd.llsdEncode([[[1]]])
+        for name, decode in self.decoders():
+            with self.subTest(decoder = name):
+                self.assertEqual(decode(data, maxDepth = 3), [[[1]]])
+                with self.assertRaises(ValueError):
+                    decode(data, maxDepth = 2)
+                with self.assertRaises(ValueError):
+                    decode(b"<llsd>" + b"<array>" * 5000 + b"</array>" * 5000 + b"</llsd>")
+
+class NestingTest(unittest.TestCase):
+    def deep(self, format, depth):
+        if format == "binary":
+            return b"[\0\0\0\1" * depth + b"!" + b"]" * depth
+        return b"[" * depth + b"!" + b"]" * depth
+
+    def testDeepDocuments(self):
+        for format in ("binary", "notation"):
+            with self.subTest(format = format):
+                with self.assertRaises(ValueError):
+                    llsd.llsdDecode(self.deep(format, 5000))
+                value = llsd.llsdDecode(self.deep(format, 5000), maxDepth = None)
+                for i in range(5000):
+                    value, = value
+                self.assertIsNone(value)
+
+    def testRoundTrip(self):
+        value = {"a": [1, 2.5, None, True, "x", b"y", {}, []], "b": {"c": [[]]}}
+        for format in ("binary", "notation"):
+            with self.subTest(format = format):
+                self.assertEqual(llsd.llsdDecode(llsd.llsdEncode(value,
+                    format = format)), value)
+
+class BinaryTest(unittest.TestCase):
+    def testInvalidDates(self):
+        for seconds in (1e300, float("inf"), float("nan")):
+            with self.subTest(seconds = seconds):
+                with self.assertRaises(ValueError):
+                    llsd.llsdDecode(b"<?llsd/binary?>\nd" + struct.pack("<d", seconds))
+
+class SniffTest(unittest.TestCase):
+    def testStrWithByteOrderMark(self):
+        for format in ("xml", "notation"):
+            with self.subTest(format = format):
+                document = "\ufeff  " + llsd.llsdEncode({"name": "F\xe9lix"},
+                    format = format).decode()
+                self.assertEqual(llsd.llsdDecode(document), {"name": "F\xe9lix"})
+
+    def testStrKeepsItsEncodingDeclaration(self):
+        document = '\ufeff<?xml version="1.0" encoding="ISO-8859-1"?>' \
+            "<llsd><string>\xe9</string></llsd>"
+        self.assertEqual(llsd.llsdDecode(document), "\xe9")
+        self.assertEqual(llsd.llsdDecode(document[1:]), "\xe9")
+
+class LazyTest(unittest.TestCase):
+    def testMappingMethods(self):
+        view = llsd.llsdDecode(llsd.llsdEncode({"a": [1, 2], "b": "x"}), lazy = True)
+        self.assertIsInstance(view, llsd.LazyMap)
+        self.assertEqual(list(view.values()), [[1, 2], "x"])
+        self.assertEqual(dict(view.items())["b"], "x")
+        self.assertEqual(view["a"].index(2), 1)
+        self.assertEqual(view["a"].count(1), 1)
+        self.assertIsInstance(llsd.load(io.BytesIO(llsd.llsdEncode([1])), lazy = True),
+            llsd.LazyArray)
+
+    def testUnknownOptions(self):
+        data = llsd.llsdEncode([1])
+        with self.assertRaises(TypeError):
+            llsd.llsdDecode(data, lazzy = True)
+        with self.assertRaises(TypeError):
+            llsd.load(io.BytesIO(data), maxnodes = 1)
+
+class ManyTest(unittest.TestCase):
+    values = [{"n": i, "name": "x" * (i % 7)} for i in range(150)]
+
+    def testOrderAndOptions(self):
+        for workers in (1, 2):
+            with self.subTest(workers = workers):
+                encoded = list(llsd.encodeMany(iter(self.values), workers = workers,
+                    chunkSize = 16, format = "binary"))
+                self.assertEqual(encoded, [llsd.llsdEncode(value, format = "binary")
+                    for value in self.values])
+                documents = [memoryview(document) for document in encoded]
+                self.assertEqual(list(llsd.decodeMany(documents, workers = workers,
+                    chunkSize = 16)), self.values)
+                xml = llsd.encodeMany(self.values, workers = workers, chunkSize = 16)
+                with self.assertRaises(ValueError):
+                    list(llsd.decodeMany(xml, workers = workers, chunkSize = 16,
+                        maxNodes = 2))
+
+    def testEmpty(self):
+        self.assertEqual(list(llsd.decodeMany([], workers = 2)), [])
+
+class TypedArrayTest(unittest.TestCase):
+    def testEncoders(self):
+        values = array.array("i", [1, -2, 3])
+        for format in ("xml", "binary", "notation"):
+            with self.subTest(format = format):
+                self.assertEqual(llsd.llsdDecode(llsd.llsdEncode(values,
+                    format = format)), [1, -2, 3])
+
+    @unittest.skipUnless(llsd.numpy, "needs NumPy")
+    def testNumpyEncoders(self):
+        values = llsd.numpy.array([1.5, 2.5])
+        for format in ("xml", "binary", "notation"):
+            with self.subTest(format = format):
+                self.assertEqual(llsd.llsdDecode(llsd.llsdEncode(values,
+                    format = format)), [1.5, 2.5])
+        root = llsd.ET.Element("llsd")
+        llsd.llsdEncodeXml(values, root)
+        self.assertEqual(len(root[0]), 2)
+
+    def testWideIntegers(self):
+        kinds = ["array"] + (["numpy"] if llsd.numpy else [])
+        for kind in kinds:
+            with self.subTest(kind = kind):
+                self.assertEqual(list(llsd.typedArray("integer", ["1", "2"], kind)), [1, 2])
+                values = llsd.typedArray("integer", ["1", str(1 << 40)], kind)
+                self.assertEqual(list(values), [1, 1 << 40])
+
+if __name__ == "__main__":
+    unittest.main()
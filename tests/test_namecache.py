@@ -0,0 +1,58 @@
+import io
+import unittest
+from unittest import mock
+
+from regapi import NameCache, RegAPI, RegAPIError, llsd
+
+class NameCacheTest(unittest.TestCase):
+    def testTransientErrorsAreNotRemembered(self):
+        cache = NameCache(takenCodes = (7,))
+        cache.set("Busy", 1, RegAPIError("Rate limited", "Slow down", 3))
+        self.assertIsNone(cache.get("Busy", 1))
+
+    def testTakenCodesAreRememberedOutsideTheFilter(self):
+        cache = NameCache(takenCodes = (7,))
+        cache.set("Taken", 1, RegAPIError("E7", "Taken", 7))
+        self.assertIsInstance(cache.get("Taken", 1), RegAPIError)
+        cache.invalidate("Taken", 1)
+        self.assertIsNone(cache.get("Taken", 1))
+
+    def testTakenErrorNames(self):
+        cache = NameCache()
+        for name in ("Username taken", "USERNAME_ALREADY_EXISTS", "Invalid username"):
+            self.assertTrue(cache.isTaken(RegAPIError(name, "", 1)), name)
+        for name in ("Rate limited", "Internal server error", "Invalid capability"):
+            self.assertFalse(cache.isTaken(RegAPIError(name, "", 1)), name)
+
+    def testFalseGoesInTheFilter(self):
+        cache = NameCache()
+        cache.set("Gone", 1, False)
+        cache.invalidate("Gone", 1)
+        self.assertIs(cache.get("gone", 1), False)
+        cache.set("Free", 1, True)
+        self.assertIs(cache.get("Free", 1), True)
+
+class CheckNameTest(unittest.TestCase):
+    def check(self, code, name):
+        api = RegAPI({"check_name": "http://localhost/check_name"}, pool = False,
+            nameCache = NameCache())
+        api.catalogs.update("get_error_codes", {"data": [[code, name, "No"]]})
+        requests = []
+        def doRequest(req, pool = None):
+            requests.append(req)
+            return io.BytesIO(llsd.llsdEncode([code]))
+        with mock.patch("regapi.regapi.doRequest", doRequest):
+            for i in range(3):
+                with self.assertRaises(RegAPIError) as raised:
+                    api.checkName("FelixWolf")
+                self.assertEqual(raised.exception.code, code)
+        return len(requests)
+
+    def testTakenNameIsServedFromTheCache(self):
+        self.assertEqual(self.check(4, "Username taken"), 1)
+
+    def testTransientErrorIsAskedAgain(self):
+        self.assertEqual(self.check(9, "Too many requests"), 3)
+
+if __name__ == "__main__":
+    unittest.main()
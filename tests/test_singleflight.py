@@ -0,0 +1,80 @@
+import asyncio
+import threading
+import time
+import unittest
+
+from regapi.singleflight import SingleFlight, AsyncSingleFlight
+
+class SingleFlightTest(unittest.TestCase):
+    def runThreads(self, function, threads = 8):
+        flights = SingleFlight()
+        results = []
+        def worker():
+            try:
+                results.append(flights.do("key", function))
+            except ValueError as e:
+                results.append(e)
+        workers = [threading.Thread(target = worker) for i in range(threads)]
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+        self.assertEqual(flights.calls, {})
+        return results
+
+    def testConcurrentCallsShareOne(self):
+        calls = []
+        def function():
+            calls.append(1)
+            time.sleep(0.1)
+            return len(calls)
+        self.assertEqual(self.runThreads(function), [1] * 8)
+        self.assertEqual(len(calls), 1)
+
+    def testExceptionIsShared(self):
+        calls = []
+        def function():
+            calls.append(1)
+            time.sleep(0.1)
+            raise ValueError("failed")
+        results = self.runThreads(function)
+        self.assertEqual(len(calls), 1)
+        self.assertTrue(all(isinstance(result, ValueError) for result in results))
+
+    def testLaterCallsRunAgain(self):
+        flights = SingleFlight()
+        self.assertEqual(flights.do("key", lambda: 1), 1)
+        self.assertEqual(flights.do("key", lambda: 2), 2)
+        self.assertEqual(flights.do("other", lambda x: x, 3), 3)
+
+class AsyncSingleFlightTest(unittest.TestCase):
+    def testConcurrentCallsShareOne(self):
+        calls = []
+        async def function(value):
+            calls.append(value)
+            await asyncio.sleep(0.05)
+            return value
+        async def run():
+            flights = AsyncSingleFlight()
+            results = await asyncio.gather(*[flights.do("key", function, i)
+                for i in range(8)])
+            self.assertEqual(flights.calls, {})
+            return results
+        self.assertEqual(asyncio.run(run()), [0] * 8)
+        self.assertEqual(calls, [0])
+
+    def testCancelledCallerDoesNotCancelOthers(self):
+        async def function():
+            await asyncio.sleep(0.05)
+            return "done"
+        async def run():
+            flights = AsyncSingleFlight()
+            first = asyncio.ensure_future(flights.do("key", function))
+            second = asyncio.ensure_future(flights.do("key", function))
+            await asyncio.sleep(0)
+            first.cancel()
+            return await second
+        self.assertEqual(asyncio.run(run()), "done")
+
+if __name__ == "__main__":
+    unittest.main()